@@ -5,7 +5,15 @@ ADMIN PANEL - Admin only commands
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import config
-import database as db
+import ai_pool
+import user_cache
+import settings_cache
+import membership
+import outbox
+import edits
+import broadcaster
+import router
+import locks
 from functools import wraps
 
 # Admin decorator
@@ -32,6 +40,10 @@ Commands:
 /broadcast - Send message to all
 /stats - Bot statistics
 /users - Total users count
+/poolstats - Bot AI pool metrics
+/cachestats - In-memory cache hit rates
+/outboxstats - Outgoing request queue
+/routestats - Button handler timings
 
 ━━━━━━━━━━━━━━━━━━━━━━"""
     
@@ -46,13 +58,8 @@ async def set_forcesub(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     channel = context.args[0]
     
-    # Update database
-    db.update_settings('forcesub_channel', channel)
-    db.update_settings('forcesub_enabled', True)
-    
-    # Update config
-    config.FORCESUB_CHANNEL = channel
-    config.FORCESUB_ENABLED = True
+    # Update database (other processes pick it up on their next poll)
+    await settings_cache.update(forcesub_channel=channel, forcesub_enabled=True)
     
     await update.message.reply_text(f"✅ Forcesub set to {channel}")
 
@@ -64,14 +71,93 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     message = ' '.join(context.args)
-    users = db.users.find()
     
-    count = 0
-    for user in users:
-        try:
-            await context.bot.send_message(user['user_id'], message)
-            count += 1
-        except:
-            pass
+    # Runs in the background; progress is edited into its status message
+    await broadcaster.start(context.bot, message, update.effective_chat.id)
+
+
+@admin_only
+async def pool_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show bot AI pool queue depth and compute time"""
+    m = ai_pool.get_metrics()
+    text = f"""━━━━━━━━━━━━━━━━━━━━━━
+    AI POOL
+━━━━━━━━━━━━━━━━━━━━━━
+
+Executor: {m['executor']} x{m['workers']}
+In flight: {m['in_flight']} (peak {m['peak_in_flight']})
+Moves: {m['moves']} • Timeouts: {m['timeouts']}
+
+Compute: {m['compute_avg_ms']:.1f} ms avg • {m['compute_max_ms']:.1f} ms max
+Queue wait: {m['wait_avg_ms']:.1f} ms avg • {m['wait_max_ms']:.1f} ms max
+Batches: {m.get('batches', 0)} • avg size {m.get('avg_batch', 0.0):.1f}
+
+━━━━━━━━━━━━━━━━━━━━━━"""
     
-    await update.message.reply_text(f"✅ Broadcast sent to {count} users")
+    await update.message.reply_text(text)
+
+@admin_only
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show in-memory cache sizes and hit rates"""
+    u = user_cache.get_metrics()
+    m = membership.get_metrics()
+    text = f"""━━━━━━━━━━━━━━━━━━━━━━
+    CACHES
+━━━━━━━━━━━━━━━━━━━━━━
+
+Known users: {u['size']} / {u['capacity']}
+Hits: {u['hits']} • Misses: {u['misses']} ({u['hit_rate'] * 100:.1f}% hit)
+Misses: {u['new']} new • {u['changed']} changed • {u['stale']} stale
+
+Memberships: {m['size']} / {m['capacity']}
+Hits: {m['hits']} • Coalesced: {m['coalesced']} ({m['hit_rate'] * 100:.1f}% saved)
+API lookups: {m['lookups']} • Invalidated: {m['invalidated']}
+
+━━━━━━━━━━━━━━━━━━━━━━"""
+    
+    await update.message.reply_text(text)
+
+@admin_only
+async def outbox_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show outgoing request queue depth and wait times"""
+    m = outbox.get_metrics()
+    e = edits.get_metrics()
+    lines = [
+        f"{name.title()}: {p['depth']} queued • {p['granted']} sent\n"
+        f"   wait {p['wait_avg_ms']:.0f} ms avg • {p['wait_max_ms']:.0f} ms max"
+        for name, p in m['priorities'].items()
+    ]
+    text = f"""━━━━━━━━━━━━━━━━━━━━━━
+    OUTBOX
+━━━━━━━━━━━━━━━━━━━━━━
+
+Queued: {m['depth']} (peak {m['peak_depth']})
+429s: {m['retry_after']} • Paused chats: {m['paused_chats']}
+Edits: {e['sent']} sent • {e['skipped']} skipped • {e['collapsed']} collapsed
+
+""" + "\n".join(lines) + """
+
+━━━━━━━━━━━━━━━━━━━━━━"""
+    
+    await update.message.reply_text(text)
+
+@admin_only
+async def route_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show per-button call counts and handler timings"""
+    lines = [
+        f"{name}: {r['calls']} calls • {r['errors']} errors\n"
+        f"   {r['avg_ms']:.1f} ms avg • {r['max_ms']:.0f} ms max"
+        for name, r in router.get_metrics().items() if r['calls']
+    ]
+    k = locks.get_metrics()
+    text = f"""━━━━━━━━━━━━━━━━━━━━━━
+    ROUTES
+━━━━━━━━━━━━━━━━━━━━━━
+
+Game/challenge locks: {k['acquired']} taken • {k['contended']} waited • {k['keys']} held now
+
+""" + ("\n".join(lines) or "No buttons pressed yet") + """
+
+━━━━━━━━━━━━━━━━━━━━━━"""
+    
+    await update.message.reply_text(text)
@@ -0,0 +1,128 @@
+"""
+AI POOL - Bot move computation off the event loop
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+import game
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_batcher = None
+
+# Pool metrics (read with get_metrics)
+_metrics = {
+    'in_flight': 0,      # submitted and not finished (queued + running)
+    'peak_in_flight': 0,
+    'moves': 0,
+    'timeouts': 0,
+    'compute_total': 0.0,
+    'compute_max': 0.0,
+    'wait_total': 0.0,
+    'wait_max': 0.0,
+}
+
+def get_executor():
+    """Shared executor, created on first use from config"""
+    global _executor
+    if _executor is None:
+        if config.AI_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=config.AI_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=config.AI_WORKERS,
+                                           thread_name_prefix='ai')
+        logger.info(f"AI pool: {config.AI_EXECUTOR} x{config.AI_WORKERS}")
+    return _executor
+
+def get_batcher():
+    """Micro-batcher for 3x3 moves, or None when AI_BATCH_WINDOW_MS is 0"""
+    global _batcher
+    if _batcher is None and config.AI_BATCH_WINDOW_MS > 0:
+        import batch  # NumPy is only needed when batching is on
+        _batcher = batch.MoveBatcher(config.AI_BATCH_WINDOW_MS / 1000)
+    return _batcher
+
+def shutdown():
+    """Stop the executor (pending moves are dropped)"""
+    global _executor, _batcher
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    _batcher = None
+
+def _compute(game_session):
+    """Runs in the pool: (move, started_at, compute_seconds)"""
+    started = time.time()
+    move = game.get_bot_move(game_session)
+    return move, started, time.time() - started
+
+async def compute_bot_move(game_session):
+    """Bot move from the pool, or a quick fallback if the budget runs out"""
+    batcher = get_batcher()
+    if batcher is not None and game.get_rules(game_session) is game.CLASSIC:
+        # Table-driven 3x3 moves are cheapest resolved together on the loop
+        try:
+            return await batcher.submit(game_session)
+        except Exception:
+            # Already logged by the batcher
+            return game.quick_move(game_session)
+
+    loop = asyncio.get_running_loop()
+    # Workers only read the session; a copy keeps a late result from racing
+    # with the fallback move being applied here
+    snapshot = game_session.copy()
+
+    _metrics['in_flight'] += 1
+    _metrics['peak_in_flight'] = max(_metrics['peak_in_flight'], _metrics['in_flight'])
+    submitted = time.time()
+    future = loop.run_in_executor(get_executor(), _compute, snapshot)
+    future.add_done_callback(_on_done)
+
+    try:
+        move, started, compute_time = await asyncio.wait_for(
+            asyncio.shield(future), config.AI_MOVE_BUDGET
+        )
+    except asyncio.TimeoutError:
+        _metrics['timeouts'] += 1
+        logger.warning(f"AI move over budget for {game_session.game_id}, using fallback")
+        return game.quick_move(game_session)
+    except Exception:
+        # Already logged by _on_done
+        return game.quick_move(game_session)
+
+    wait_time = max(started - submitted, 0.0)
+    _metrics['moves'] += 1
+    _metrics['compute_total'] += compute_time
+    _metrics['compute_max'] = max(_metrics['compute_max'], compute_time)
+    _metrics['wait_total'] += wait_time
+    _metrics['wait_max'] = max(_metrics['wait_max'], wait_time)
+    return move
+
+def _on_done(future):
+    """Pool slot freed (also fires for moves that ran past their budget)"""
+    _metrics['in_flight'] -= 1
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"AI move failed: {future.exception()!r}")
+
+def get_metrics():
+    """Snapshot of queue depth and timing, averages in milliseconds"""
+    moves = _metrics['moves'] or 1
+    batched = _batcher.get_metrics() if _batcher is not None else {}
+    return {
+        **batched,
+        'executor': config.AI_EXECUTOR,
+        'workers': config.AI_WORKERS,
+        'in_flight': _metrics['in_flight'],
+        'peak_in_flight': _metrics['peak_in_flight'],
+        'moves': _metrics['moves'],
+        'timeouts': _metrics['timeouts'],
+        'compute_avg_ms': _metrics['compute_total'] / moves * 1000,
+        'compute_max_ms': _metrics['compute_max'] * 1000,
+        'wait_avg_ms': _metrics['wait_total'] / moves * 1000,
+        'wait_max_ms': _metrics['wait_max'] * 1000,
+    }
@@ -0,0 +1,156 @@
+"""
+BATCH AI - Vectorized bot moves for many concurrent 3x3 games
+"""
+
+import asyncio
+import logging
+
+import numpy as np
+
+import game
+
+logger = logging.getLogger(__name__)
+
+# Boards are indexed base 3: index = sum(board[i] * 3**i)
+POWERS = 3 ** np.arange(9)
+POSITIONS = 3 ** 9
+
+DIFFICULTIES = {'easy': 0, 'medium': 1, 'hard': 2, 'impossible': 3}
+
+_tables = None
+
+def _build_tables():
+    """Per-index candidate masks, shape (POSITIONS, 9) each"""
+    boards = np.arange(POSITIONS)[:, None] // POWERS % 3
+    empty = boards == 0
+
+    def completing_cells(symbol):
+        cells = np.zeros((POSITIONS, 9), dtype=bool)
+        for combo in game.WIN_COMBINATIONS:
+            line = boards[:, combo]
+            ready = ((line == symbol).sum(axis=1) == 2) & ((line == 0).sum(axis=1) == 1)
+            for i, cell in enumerate(combo):
+                cells[:, cell] |= ready & (line[:, i] == 0)
+        return cells
+
+    optimal = np.zeros((POSITIONS, 9), dtype=bool)
+    for key, (_, moves) in game.solution_table().items():
+        if moves:
+            board = game.masks_to_board(key & game.FULL_MASK, key >> 9)
+            optimal[int(np.dot(board, POWERS)), list(moves)] = True
+
+    return {
+        'empty': empty,
+        'win': completing_cells(2),    # Bot is O (2)
+        'block': completing_cells(1),  # Player is X (1)
+        'optimal': optimal,
+    }
+
+def get_tables():
+    """Lookup tables (built once, ~20k positions)"""
+    global _tables
+    if _tables is None:
+        _tables = _build_tables()
+    return _tables
+
+def get_bot_moves(sessions, rng=None):
+    """Bot moves for many games at once, in session order
+
+    3x3 sessions are resolved in vectorized passes; other variants fall
+    back to game.get_bot_move one by one.
+    """
+    rng = rng or np.random.default_rng()
+    moves = [None] * len(sessions)
+    rows = []
+    for i, session in enumerate(sessions):
+        if game.get_rules(session) is game.CLASSIC:
+            rows.append(i)
+        else:
+            moves[i] = game.get_bot_move(session)
+    if not rows:
+        return moves
+
+    tables = get_tables()
+    packed = np.array([sessions[i].bits for i in rows], dtype=np.int64)
+    cells = np.arange(9)
+    boards = (packed[:, None] >> cells & 1) + 2 * (packed[:, None] >> (cells + 9) & 1)
+    index = boards @ POWERS
+    level = np.array([DIFFICULTIES.get(sessions[i].difficulty, 3) for i in rows])
+
+    empty = tables['empty'][index]
+    win = tables['win'][index]
+    block = tables['block'][index]
+    optimal = tables['optimal'][index]
+
+    # Candidate cells per difficulty, each falling back to the next rule down
+    has_block = block.any(axis=1, keepdims=True)
+    has_win = win.any(axis=1, keepdims=True)
+    medium = np.where(has_block, block, empty)
+    hard = np.where(has_win, win, medium)
+    candidates = np.select(
+        [level[:, None] == 0, level[:, None] == 1, level[:, None] == 2],
+        [empty, medium, hard],
+        default=np.where(optimal.any(axis=1, keepdims=True), optimal, hard),
+    )
+
+    # Uniform pick among candidates: argmax of random keys on allowed cells
+    keys = rng.random(candidates.shape) + candidates
+    picks = keys.argmax(axis=1)
+    for row, pick in zip(rows, picks):
+        moves[row] = int(pick)
+    return moves
+
+# ============ MICRO-BATCHING ============
+class MoveBatcher:
+    """Collects bot-move requests for a short window, then resolves them together"""
+
+    def __init__(self, window, max_batch=1024):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.moves = 0
+        get_tables()
+
+    async def submit(self, game_session):
+        """Bot move for one game, resolved with whatever else arrives in the window"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((game_session, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        try:
+            moves = get_bot_moves([session for session, _ in pending])
+        except Exception as e:
+            logger.error(f"Batch of {len(pending)} bot moves failed: {e!r}")
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.moves += len(pending)
+        for (_, future), move in zip(pending, moves):
+            if not future.done():
+                future.set_result(move)
+
+    def get_metrics(self):
+        """Batches dispatched and average batch size"""
+        return {
+            'batches': self.batches,
+            'batched_moves': self.moves,
+            'avg_batch': self.moves / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,480 @@
+"""
+BENCHMARKS - Micro and macro timings for the game core and callback path
+
+Run:      python bench.py [--quick] [--out results.json]
+Compare:  python bench.py --baseline results.json [--threshold 0.2]
+
+Exits non-zero when a case is slower than the baseline by more than the
+threshold, so it can gate a deploy.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+
+import game
+import rules
+import ultimate
+
+# Variants on a plain size x size grid (ultimate has its own cases)
+GRID_VARIANTS = [v for v in rules.VARIANTS if v != 'ultimate']
+
+CASES = {}
+
+def case(name):
+    """Register a benchmark: the function does setup and returns (run, ops)"""
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+# ============ LIST REFERENCE ============
+# The pre-bitboard implementation, kept only as a reference point.
+def _list_check(board):
+    for combo in game.WIN_COMBINATIONS:
+        if board[combo[0]] == board[combo[1]] == board[combo[2]] != 0:
+            return board[combo[0]]
+    return 0
+
+def _list_winning_move(board, symbol):
+    for combo in game.WIN_COMBINATIONS:
+        values = [board[i] for i in combo]
+        if values.count(symbol) == 2 and values.count(0) == 1:
+            return combo[values.index(0)]
+    return None
+
+# ============ POSITIONS ============
+def _random_sessions(count, variant='3x3', difficulty='easy', seed=7):
+    """Random mid-game sessions (no winner yet), bot to move"""
+    rng = random.Random(seed)
+    cells = rules.get_rules(variant).cells
+    sessions = []
+    while len(sessions) < count:
+        session = game.create_game('bench', 1, difficulty, variant)
+        for ply in range(rng.randint(1, 3) * 2 - 1):
+            free = [i for i in range(cells) if session.board[i] == 0]
+            player = 1 if ply % 2 == 0 else 'bot'
+            if game.make_move(session, rng.choice(free), player)['status'] != 'ongoing':
+                break
+        else:
+            sessions.append(session)
+    return sessions
+
+def _random_boards(count, seed=7):
+    return [s.board for s in _random_sessions(count, seed=seed)]
+
+# ============ CORE ============
+@case('core.make_move')
+def bench_make_move(n):
+    sessions = _random_sessions(n)
+    moves = [s.board.index(0) for s in sessions]
+
+    def run():
+        for session, cell in zip(sessions, moves):
+            bits = session.bits
+            game.make_move(session, cell, 'bot')
+            session.bits = bits
+    return run, n
+
+@case('core.check_game_status')
+def bench_check_status(n):
+    sessions = _random_sessions(n)
+
+    def run():
+        for session in sessions:
+            game.check_game_status(session)
+    return run, n
+
+@case('core.winning_move')
+def bench_winning_move(n):
+    masks = [game.board_to_masks(b) for b in _random_boards(n)]
+
+    def run():
+        for x_mask, o_mask in masks:
+            if game._winning_move(o_mask, x_mask) is None:
+                game._winning_move(x_mask, o_mask)
+    return run, n
+
+@case('ref.list_winning_move')
+def bench_list_winning_move(n):
+    boards = _random_boards(n)
+
+    def run():
+        for board in boards:
+            if _list_winning_move(board, 2) is None:
+                _list_winning_move(board, 1)
+    return run, n
+
+@case('ref.list_move_check')
+def bench_list_move_check(n):
+    boards = [list(b) for b in _random_boards(n)]
+    moves = [b.index(0) for b in boards]
+
+    def run():
+        for board, cell in zip(boards, moves):
+            board[cell] = 2
+            _list_check(board)
+            board[cell] = 0
+    return run, n
+
+# ============ AI ============
+def _bot_move_case(variant, difficulty):
+    def bench(n):
+        sessions = _random_sessions(n, variant, difficulty)
+
+        def run():
+            for session in sessions:
+                game.get_bot_move(session)
+        return run, n
+    return bench
+
+for _variant in GRID_VARIANTS:
+    for _difficulty in game.DIFFICULTY_CODES:
+        if _difficulty == 'impossible' and _variant != rules.DEFAULT_VARIANT:
+            continue  # Time-bounded search: covered by engine.* at a fixed depth
+        case(f'ai.{_variant}.{_difficulty}')(_bot_move_case(_variant, _difficulty))
+
+def _engine_case(variant, depth):
+    def bench(n):
+        sessions = _random_sessions(max(n // 100, 1), variant)
+
+        def run():
+            for session in sessions:
+                searcher = game.get_searcher(session.rules)
+                searcher.tt.clear()
+                searcher.search(session.o_mask, session.x_mask, max_depth=depth)
+        return run, len(sessions)
+    return bench
+
+case('engine.4x4.depth4')(_engine_case('4x4', 4))
+case('engine.5x5.depth3')(_engine_case('5x5', 3))
+
+@case('engine.3x3.solved')
+def bench_engine_solved(n):
+    """Full searches with a warm, shared table, checked against the solved table
+
+    Table entries left by earlier searches must never make the engine
+    settle for a slower win (or a faster loss) than perfect play.
+    """
+    from engine import Searcher
+    positions = [(key, score) for key, (score, moves) in game.solution_table().items() if moves]
+    random.Random(3).shuffle(positions)
+    searcher = Searcher(3, game.CLASSIC.win_masks)
+
+    def run():
+        for key, score in positions:
+            x_mask, o_mask = key & game.FULL_MASK, key >> 9
+            if x_mask.bit_count() == o_mask.bit_count():
+                result = searcher.search(x_mask, o_mask)
+            else:
+                result = searcher.search(o_mask, x_mask)
+            assert result['score'] == score, f"position {key}: engine {result['score']}, solved {score}"
+    return run, len(positions)
+
+@case('ai.batch')
+def bench_batch(n):
+    try:
+        import batch
+    except ImportError:
+        return None
+    sessions = [s for d in game.DIFFICULTY_CODES for s in _random_sessions(n // 4, difficulty=d)]
+    batch.get_tables()
+
+    def run():
+        batch.get_bot_moves(sessions)
+    return run, len(sessions)
+
+# ============ SELF-PLAY ============
+def _selfplay_case(variant):
+    def bench(n):
+        rng = random.Random(11)
+        games = max(n // 20, 1)
+        cells = rules.get_rules(variant).cells
+
+        def run():
+            for _ in range(games):
+                session = game.create_game('bench', 1, 'hard', variant)
+                while True:
+                    free = [i for i in range(cells) if session.board[i] == 0]
+                    if game.make_move(session, rng.choice(free), 1)['status'] != 'ongoing':
+                        break
+                    if game.make_move(session, game.get_bot_move(session), 'bot')['status'] != 'ongoing':
+                        break
+        return run, games
+    return bench
+
+for _variant in GRID_VARIANTS:
+    case(f'selfplay.{_variant}.hard')(_selfplay_case(_variant))
+
+@case('ultimate.playout')
+def bench_ultimate_playout(n):
+    state = ultimate.State()
+    rng = random.Random(3).random
+
+    def run():
+        for _ in range(n):
+            state.copy().rollout(rng)
+    return run, n
+
+@case('ultimate.mcts.medium')
+def bench_ultimate_mcts(n):
+    state = ultimate.State()
+    playouts = ultimate.PLAYOUTS['medium']
+
+    def run():
+        ultimate.search(state, playouts)
+    return run, 1
+
+# ============ UI ============
+@case('ui.render_board')
+def bench_render_board(n):
+    try:
+        import utils
+    except ImportError:
+        return None
+    sessions = [s for v in GRID_VARIANTS for s in _random_sessions(n // 3, v)]
+
+    def run():
+        for session in sessions:
+            utils.render_board(session)
+    return run, len(sessions)
+
+@case('ui.game_keyboard')
+def bench_game_keyboard(n):
+    try:
+        import utils
+    except ImportError:
+        return None
+    sessions = [s for v in GRID_VARIANTS for s in _random_sessions(n // 3, v)]
+
+    def run():
+        for session in sessions:
+            utils.get_game_keyboard(session)
+    return run, len(sessions)
+
+# ============ END TO END ============
+class MemoryStorage:
+    """In-memory stand-in for the database module"""
+
+    def __init__(self):
+        self.games = {}
+        self.results = {}
+
+    async def save_active_games(self, docs, deleted_ids=()):
+        for doc in docs:
+            self.games[doc['game_id']] = doc
+        for game_id in deleted_ids:
+            self.games.pop(game_id, None)
+
+    async def update_user_stats(self, user_id, result):
+        self.results[result] = self.results.get(result, 0) + 1
+
+    def __getattr__(self, name):
+        # Anything else the handlers touch is a no-op
+        async def noop(*args, **kwargs):
+            return None
+        return noop
+
+class FakeQuery:
+    """Callback query that records edits instead of calling Telegram"""
+
+    def __init__(self, data, user_id):
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id, first_name='Bench', username='bench')
+        self.message = SimpleNamespace(chat_id=user_id, message_id=1)
+        self.edits = 0
+        self.alerts = 0
+
+    async def answer(self, *args, **kwargs):
+        if kwargs.get('show_alert'):
+            self.alerts += 1
+
+    async def edit_message_text(self, text=None, reply_markup=None, **kwargs):
+        self.edits += 1
+
+class FakeBot:
+    """Telegram bot that accepts every call and sends nothing"""
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+    async def edit_message_reply_markup(self, *args, **kwargs):
+        pass
+
+    async def delete_message(self, *args, **kwargs):
+        pass
+
+@case('e2e.handle_callback')
+def bench_handle_callback(n):
+    try:
+        import bot
+    except ImportError:
+        return None
+    import game_store
+    import stats_writer
+    storage = MemoryStorage()
+    bot.db = stats_writer.db = storage
+    context = SimpleNamespace(bot=FakeBot())
+    games = max(n // 20, 1)
+    rng = random.Random(5)
+
+    async def play():
+        callbacks = 0
+        for g in range(games):
+            session = game.create_game(f"bench_{g}", 1, 'hard')
+            game_store.save(session)
+            while session is not None:
+                free = [i for i in range(9) if session.board[i] == 0]
+                query = FakeQuery(f"move_{session.game_id}_{rng.choice(free)}", 1)
+                await bot.handle_callback(SimpleNamespace(callback_query=query), context)
+                callbacks += 1
+                session = game_store.get(session.game_id)
+        return callbacks
+
+    # Count callbacks once so timings are per callback
+    ops = asyncio.run(play())
+
+    def run():
+        rng.seed(5)
+        asyncio.run(play())
+    rng.seed(5)
+    return run, ops
+
+@case('e2e.concurrent_callbacks')
+def bench_concurrent_callbacks(n):
+    """Many games at once, with double taps and surrenders racing the bot
+
+    Checks that no accepted move is lost or applied twice and that every
+    game ends (and is scored) exactly once.
+    """
+    try:
+        import bot
+    except ImportError:
+        return None
+    import game_store
+    import stats_writer
+    storage = MemoryStorage()
+    bot.db = stats_writer.db = storage
+    context = SimpleNamespace(bot=FakeBot())
+    games = max(n // 20, 2)
+    rng = random.Random(11)
+
+    async def tap(data, user_id):
+        query = FakeQuery(data, user_id)
+        await bot.handle_callback(SimpleNamespace(callback_query=query), context)
+        return query.alerts == 0
+
+    async def player(g):
+        user_id = 1000 + g
+        session = game.create_game(f"stress_{g}", user_id, 'hard')
+        game_store.save(session)
+        accepted = callbacks = 0
+        while game_store.get(session.game_id) is not None:
+            free = [i for i in range(9) if session.board[i] == 0]
+            cell = rng.choice(free)
+            taps = [tap(f"move_{session.game_id}_{cell}", user_id) for _ in range(rng.randint(1, 3))]
+            moves = len(taps)
+            if rng.random() < 0.1:
+                taps.append(tap(f"forfeit_{session.game_id}", user_id))
+            answers = await asyncio.gather(*taps)
+            accepted += sum(answers[:moves])
+            callbacks += len(taps)
+        return session, accepted, callbacks
+
+    async def play():
+        storage.results.clear()
+        played = await asyncio.gather(*(player(g) for g in range(games)))
+        callbacks = 0
+        for session, accepted, count in played:
+            placed = sum(1 for cell in session.board if cell == 1)
+            assert placed == accepted, f"{session.game_id}: {accepted} moves accepted, {placed} on the board"
+            callbacks += count
+        scored = sum(storage.results.values())
+        assert scored == games, f"{games} games, {scored} results recorded"
+        return callbacks
+
+    ops = asyncio.run(play())
+
+    def run():
+        asyncio.run(play())
+    return run, ops
+
+# ============ RUNNER ============
+def run_cases(names, n, repeat):
+    """Time the selected cases, microseconds per op"""
+    results = {}
+    for name in names:
+        prepared = CASES[name](n)
+        if prepared is None:
+            print(f"{name:28} skipped (dependency missing)")
+            continue
+        run, ops = prepared
+        times = [t / ops * 1e6 for t in timeit.repeat(run, number=1, repeat=repeat)]
+        results[name] = {
+            'min_us': min(times),
+            'median_us': statistics.median(times),
+            'ops': ops,
+        }
+        print(f"{name:28} {results[name]['min_us']:12.2f} us/op  (median {results[name]['median_us']:.2f})")
+    return results
+
+def compare(results, baseline, threshold):
+    """Print ratio vs baseline per case, return names of regressed cases"""
+    regressed = []
+    print("\nvs baseline:")
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        ratio = result['min_us'] / old['min_us']
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"{name:28} x{ratio:5.2f}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game core and callback path")
+    parser.add_argument('cases', nargs='*', help="case name prefixes (default: all)")
+    parser.add_argument('--quick', action='store_true', help="fewer positions and repeats")
+    parser.add_argument('--out', help="write results JSON here")
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if not args.cases or any(name.startswith(p) for p in args.cases)]
+    n, repeat = (200, 3) if args.quick else (1000, 5)
+    results = run_cases(names, n, repeat)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
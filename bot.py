@@ -4,7 +4,10 @@ Handles: /start, /play, /challenge, /stats, /help, callbacks
 """
 
 import os
+import time
 import logging
+from datetime import timezone
+from functools import partial
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from dotenv import load_dotenv
@@ -14,6 +17,21 @@ import game
 import database as db
 import utils
 import admin
+import ai_pool
+import rules
+import ultimate
+import game_store
+import leaderboard
+import stats_writer
+import user_cache
+import settings_cache
+import membership
+import timers
+import outbox
+import edits
+import broadcaster
+import router
+import locks
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -25,15 +43,15 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = update.effective_chat.id
     
-    # Add user to database if new
-    db.add_user(user.id, user.username, user.first_name)
+    # Add user to database if new (or changed, or last seen long ago)
+    await user_cache.touch(user.id, user.username, user.first_name)
     
     # Check forcesub
     if config.FORCESUB_ENABLED:
-        is_member = await utils.check_membership(context.bot, user.id)
+        is_member = await membership.check(context.bot, user.id)
         
         if not is_member:
-            # Show forcesub message
+            # Show forcesub message ("I've joined" checks again)
             await update.message.reply_text(
                 text=utils.FORCESUB_MESSAGE,
                 reply_markup=utils.get_forcesub_keyboard()
@@ -55,10 +73,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ============ PLAY COMMAND ============
 async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start new game vs bot"""
-    # Show difficulty selection
+    # Show board selection
     await update.message.reply_text(
-        text=utils.DIFFICULTY_MESSAGE,
-        reply_markup=utils.get_difficulty_keyboard()
+        text=utils.BOARD_MESSAGE,
+        reply_markup=utils.get_board_size_keyboard()
     )
 
 # ============ CHALLENGE COMMAND ============
@@ -72,20 +90,22 @@ async def challenge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     challenger = update.effective_user
     challenge_id = utils.generate_game_id()
     
-    # Store challenge
-    db.create_challenge(challenge_id, challenger.id, update.effective_chat.id)
-    
     # Show challenge message
-    await update.message.reply_text(
+    message = await update.message.reply_text(
         text=utils.get_challenge_message(challenger.first_name),
         reply_markup=utils.get_challenge_keyboard(challenge_id)
     )
+    
+    # Store challenge, expiring after CHALLENGE_TIMEOUT
+    await db.create_challenge(challenge_id, challenger.id, message.chat_id, message.message_id)
+    schedule_challenge_timeout(context.bot, challenge_id, message.chat_id, message.message_id,
+                               time.time() + config.CHALLENGE_TIMEOUT)
 
 # ============ STATS COMMAND ============
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user statistics"""
     user_id = update.effective_user.id
-    stats = db.get_user_stats(user_id)
+    stats = await db.get_user_stats(user_id)
     
     await update.message.reply_text(
         text=utils.format_stats(stats),
@@ -95,10 +115,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ============ LEADERBOARD COMMAND ============
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show top players"""
-    top_players = db.get_leaderboard(limit=10)
-    
     await update.message.reply_text(
-        text=utils.format_leaderboard(top_players),
+        text=leaderboard.get_text(),
         reply_markup=utils.get_back_keyboard()
     )
 
@@ -112,121 +130,373 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ============ CALLBACK HANDLER ============
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle all button clicks"""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    user = query.from_user
-    
-    # Main Menu Callbacks
-    if data == "play_bot":
-        await query.edit_message_text(
-            text=utils.DIFFICULTY_MESSAGE,
-            reply_markup=utils.get_difficulty_keyboard()
-        )
+    """Handle all button clicks (routes below)"""
+    await router.dispatch(update, context)
+
+async def show(call, text, reply_markup=None):
+    """Edit the pressed button's message (through edits, so its digest stays current)"""
+    message = call.query.message
+    await edits.edit(call.context.bot, message.chat_id, message.message_id, text, reply_markup)
+
+# Main Menu Callbacks
+@router.route("play_bot", exact=True)
+@router.route("play_again", exact=True)
+async def on_play(call):
+    await show(call, utils.BOARD_MESSAGE, utils.get_board_size_keyboard())
+
+@router.route("menu", exact=True)
+async def on_menu(call):
+    await show(call, utils.get_welcome_message(call.user.first_name), utils.get_main_menu_keyboard())
+
+# Forcesub prompt's "I've joined"
+@router.route("joined", exact=True)
+async def on_joined(call):
+    membership.recheck(call.user.id)
+    if not await membership.check(call.context.bot, call.user.id):
+        await call.answer("You haven't joined the channel yet!", alert=True)
+        return
+    await show(call, utils.get_welcome_message(call.user.first_name), utils.get_main_menu_keyboard())
+
+@router.route("challenge", exact=True)
+async def on_challenge(call):
+    await show(call, utils.CHALLENGE_HINT_MESSAGE, utils.get_back_keyboard())
+
+@router.route("stats", exact=True)
+async def on_stats(call):
+    stats = await db.get_user_stats(call.user.id)
+    await show(call, utils.format_stats(stats), utils.get_back_keyboard())
+
+@router.route("leaderboard", exact=True)
+async def on_leaderboard(call):
+    await show(call, leaderboard.get_text(), utils.get_back_keyboard())
+
+@router.route("help", exact=True)
+async def on_help(call):
+    await show(call, utils.HELP_MESSAGE, utils.get_back_keyboard())
+
+# Filled cells and labels
+@router.route("occupied", exact=True)
+async def on_occupied(call):
+    await call.answer()
+
+# Board Selection
+@router.route("board", str)
+async def on_board(call, variant):
+    if variant not in rules.VARIANTS:
+        await call.answer("Unknown board!", alert=True)
+        return
+    await show(call, utils.DIFFICULTY_MESSAGE, utils.get_difficulty_keyboard(variant))
+
+# Difficulty Selection
+@router.route("difficulty", str, str)
+async def on_difficulty(call, difficulty, variant=rules.DEFAULT_VARIANT):
+    if variant not in rules.VARIANTS:
+        await call.answer("Unknown board!", alert=True)
+        return
+    if difficulty not in game.DIFFICULTY_CODES:
+        await call.answer("Unknown difficulty!", alert=True)
+        return
+    game_id = utils.generate_game_id()
     
-    # Difficulty Selection
-    elif data.startswith("difficulty_"):
-        difficulty = data.split("_")[1]
-        game_id = utils.generate_game_id()
+    # Create game session
+    game_session = game.create_game(game_id, call.user.id, difficulty, variant)
+    game_session.message = (call.query.message.chat_id, call.query.message.message_id)
+    schedule_move_timeout(call.context.bot, game_session)
+    game_store.save(game_session)
+    
+    # Show game board
+    board_text = utils.render_board(game_session)
+    keyboard = utils.get_game_keyboard(game_session)
+    
+    await call.answer()
+    await edits.edit(call.context.bot, *game_session.message, board_text, keyboard)
+
+# Game Move
+@router.route("move", str, int)
+async def on_move(call, game_id, position):
+    # Taps, surrenders and the timeout of one game take turns
+    async with locks.game(game_id):
+        await play_move(call, game_id, position)
+
+async def play_move(call, game_id, position):
+    """Apply the player's move and the bot's reply"""
+    user = call.user
+    bot = call.context.bot
+    
+    # Get game session
+    game_session = game_store.get(game_id)
+    
+    if not game_session:
+        await call.answer("Game not found!", alert=True)
+        return
+    
+    # Check if it's player's turn
+    if game_session.turn != user.id:
+        await call.answer("Not your turn!", alert=True)
+        return
+    
+    # Make move
+    result = game.make_move(game_session, position, user.id)
+    
+    if not result['valid']:
+        await call.answer(result['message'], alert=True)
+        return
+    
+    # Stop the spinner now, the bot may take a while
+    await call.answer()
+    
+    # Clock stops while the bot thinks; restarted below if the game goes on
+    timers.cancel(('move', game_id))
+    
+    # Check game status
+    if result['status'] == 'ongoing':
+        # Bot makes move
+        if game_session.type == 'bot':
+            bot_move = await ai_pool.compute_bot_move(game_session)
+            result = game.make_move(game_session, bot_move, 'bot')
+            if not result['valid']:
+                logger.error(f"Illegal bot move {bot_move} in {game_id}: {result['message']}")
+                result = game.make_move(game_session, game.quick_move(game_session), 'bot')
+    
+    # Update board display
+    board_text = utils.render_board(game_session)
+    
+    if result['status'] != 'ongoing':
+        # Game ended
+        game_store.delete(game_id)
+        ultimate.release_tree(game_id)
         
-        # Create game session
-        game_session = game.create_game(game_id, user.id, difficulty)
-        db.save_active_game(game_session)
+        # Update stats
+        if result['winner'] == user.id:
+            outcome = 'win'
+            board_text += f"\n\n✨ VICTORY! +{config.POINTS_WIN} Points"
+        elif result['winner'] == 'draw':
+            outcome = 'draw'
+            board_text += f"\n\n🤝 DRAW! +{config.POINTS_DRAW} Points"
+        else:
+            outcome = 'loss'
+            board_text += f"\n\n😢 DEFEAT! +{config.POINTS_LOSS} Points"
         
-        # Show game board
-        board_text = utils.render_board(game_session)
-        keyboard = utils.get_game_keyboard(game_session)
+        history = {
+            'game_id': game_id,
+            'variant': game_session.variant,
+            'difficulty': game_session.difficulty,
+            'player1': game_session.player1,
+            'player2': game_session.player2,
+            'winner': result['winner'],
+            'moves_count': game_session.moves_count,
+        }
+        stats = await stats_writer.record(user.id, outcome, history)
+        if stats:
+            board_text += utils.format_result_stats(stats)
+        leaderboard.update(stats)
         
-        await query.edit_message_text(
-            text=board_text,
-            reply_markup=keyboard
-        )
+        keyboard = utils.get_game_over_keyboard()
+    else:
+        schedule_move_timeout(bot, game_session)
+        game_store.save(game_session)
+        keyboard = utils.get_game_keyboard(game_session)
     
-    # Game Move
-    elif data.startswith("move_"):
-        parts = data.split("_")
-        game_id = parts[1]
-        position = int(parts[2])
-        
-        # Get game session
-        game_session = db.get_active_game(game_id)
+    # Skipped if unchanged, collapsed with newer edits if taps pile up
+    await edits.edit(bot, call.query.message.chat_id, call.query.message.message_id,
+                     board_text, keyboard)
+    
+    # Log to group in the background: the BULK lane may hold it for minutes
+    if result['status'] != 'ongoing':
+        utils.post_game_result(bot, history)
+
+# Ultimate board picker (keyboard only, the game itself is unchanged)
+@router.route("uboard", str, str)
+async def on_uboard(call, game_id, choice):
+    game_session = game_store.get(game_id)
+    
+    if not game_session:
+        await call.answer("Game not found!", alert=True)
+        return
+    
+    sub_board = None if choice == "any" else int(choice)
+    await call.answer()
+    await edits.edit(call.context.bot, call.query.message.chat_id, call.query.message.message_id,
+                     reply_markup=utils.get_game_keyboard(game_session, sub_board))
+
+# Surrender
+@router.route("forfeit", str)
+async def on_forfeit(call, game_id):
+    async with locks.game(game_id):
+        game_session = game_store.get(game_id)
         
         if not game_session:
-            await query.answer("Game not found!", show_alert=True)
+            await call.answer("Game not found!", alert=True)
             return
         
-        # Check if it's player's turn
-        if game_session['turn'] != user.id:
-            await query.answer("Not your turn!", show_alert=True)
+        if call.user.id not in (game_session.player1, game_session.player2):
+            await call.answer("This is not your game!", alert=True)
             return
         
-        # Make move
-        result = game.make_move(game_session, position, user.id)
-        
-        if not result['valid']:
-            await query.answer(result['message'], show_alert=True)
+        await call.answer()
+        timers.cancel(('move', game_id))
+        if not game_session.message:
+            game_session.message = (call.query.message.chat_id, call.query.message.message_id)
+        await end_by_forfeit(call.context.bot, game_session, call.user.id, utils.SURRENDER_MESSAGE)
+
+# Challenge Accept
+@router.route("accept", str)
+async def on_accept(call, challenge_id):
+    challenge = await db.get_challenge(challenge_id)
+    if not challenge:
+        await call.answer("Challenge expired!", alert=True)
+        return
+    if challenge['challenger_id'] == call.user.id:
+        await call.answer("You can't accept your own challenge!", alert=True)
+        return
+    # Player vs player games are not playable yet; the challenge stays open
+    await call.answer("⚔️ Player vs player matches are coming soon!", alert=True)
+
+# Challenge Decline
+@router.route("decline", str)
+async def on_decline(call, challenge_id):
+    async with locks.challenge(challenge_id):
+        challenge = await db.get_challenge(challenge_id)
+        if not challenge:
+            await call.answer("Challenge expired!", alert=True)
+            return
+        if challenge['challenger_id'] != call.user.id:
+            # Nobody has to accept; only the challenger can call it off
+            await call.answer("Only the challenger can cancel this challenge.", alert=True)
             return
         
-        # Check game status
-        if result['status'] == 'ongoing':
-            # Bot makes move
-            if game_session['type'] == 'bot':
-                bot_move = game.get_bot_move(game_session)
-                game.make_move(game_session, bot_move, 'bot')
-                
-                # Check again after bot move
-                result = game.check_game_status(game_session)
-        
-        # Update board display
-        board_text = utils.render_board(game_session)
-        
-        if result['status'] != 'ongoing':
-            # Game ended
-            db.delete_active_game(game_id)
-            
-            # Update stats
-            if result['winner'] == user.id:
-                db.update_user_stats(user.id, 'win')
-                board_text += "\n\n✨ VICTORY! +25 Points"
-            elif result['winner'] == 'draw':
-                db.update_user_stats(user.id, 'draw')
-                board_text += "\n\n🤝 DRAW! +10 Points"
-            else:
-                db.update_user_stats(user.id, 'loss')
-                board_text += "\n\n😢 DEFEAT! +5 Points"
-            
-            # Log to group
-            utils.log_game_result(context.bot, result)
-            
-            keyboard = utils.get_game_over_keyboard()
-        else:
-            keyboard = utils.get_game_keyboard(game_session)
-        
-        await query.edit_message_text(
-            text=board_text,
-            reply_markup=keyboard
-        )
+        await call.answer()
+        timers.cancel(('challenge', challenge_id))
+        await db.delete_challenge(challenge_id)
+    await show(call, utils.CHALLENGE_CANCELLED_MESSAGE)
+
+# ============ TIMEOUTS ============
+def schedule_move_timeout(bot, game_session, deadline=None):
+    """(Re)start the clock for the side to move"""
+    game_session.deadline = int(deadline or time.time() + config.MOVE_TIMEOUT)
+    timers.schedule(('move', game_session.game_id), game_session.deadline,
+                    partial(on_move_timeout, bot, game_session.game_id))
+
+async def on_move_timeout(bot, game_id):
+    """Side to move ran out of time: they forfeit"""
+    async with locks.game(game_id):
+        game_session = game_store.get(game_id)
+        # Gone, or a move got in first and restarted the clock
+        if not game_session or game_session.deadline > time.time():
+            return
+        await end_by_forfeit(bot, game_session, game_session.turn, utils.TIMEOUT_MESSAGE)
+
+async def end_by_forfeit(bot, game_session, loser, note):
+    """Finish a game as lost by `loser` (timeout or surrender)"""
+    game_id = game_session.game_id
+    game_store.delete(game_id)
+    ultimate.release_tree(game_id)
     
-    # Challenge Accept
-    elif data.startswith("accept_"):
-        challenge_id = data.split("_")[1]
-        # Handle challenge acceptance...
+    winner = game_session.player2 if loser == game_session.player1 else game_session.player1
+    history = {
+        'game_id': game_id,
+        'variant': game_session.variant,
+        'difficulty': game_session.difficulty,
+        'player1': game_session.player1,
+        'player2': game_session.player2,
+        'winner': winner,
+        'moves_count': game_session.moves_count,
+        'forfeit': True,
+    }
+    for player, outcome in ((loser, 'loss'), (winner, 'win')):
+        if player != 'bot':
+            leaderboard.update(await stats_writer.record(player, outcome, history))
+            history = None  # One history doc per game
     
-    # Play Again
-    elif data == "play_again":
-        await play_command(update, context)
+    if game_session.message:
+        chat_id, message_id = game_session.message
+        try:
+            await edits.edit(bot, chat_id, message_id,
+                             utils.render_board(game_session) + note,
+                             utils.get_game_over_keyboard())
+        except Exception as e:
+            logger.warning(f"Forfeit edit failed for {game_id}: {e!r}")
+
+def schedule_challenge_timeout(bot, challenge_id, chat_id, message_id, deadline):
+    timers.schedule(('challenge', challenge_id), deadline,
+                    partial(on_challenge_timeout, bot, challenge_id, chat_id, message_id))
+
+async def on_challenge_timeout(bot, challenge_id, chat_id, message_id):
+    """Nobody accepted in time"""
+    async with locks.challenge(challenge_id):
+        if not await db.delete_challenge(challenge_id):
+            return  # Cancelled meanwhile
+    if message_id:
+        try:
+            await edits.edit(bot, chat_id, message_id, utils.CHALLENGE_EXPIRED_MESSAGE)
+        except Exception as e:
+            logger.warning(f"Challenge expiry edit failed for {challenge_id}: {e!r}")
+
+async def restore_timers(bot):
+    """Re-arm deadlines persisted before a restart (overdue ones fire at once)"""
+    restored = 0
+    for game_session in game_store.sessions():
+        # Games saved before deadlines existed get a fresh clock
+        schedule_move_timeout(bot, game_session, game_session.deadline or None)
+        restored += 1
+    for challenge in await db.get_open_challenges():
+        created = challenge['created_at'].replace(tzinfo=timezone.utc).timestamp()
+        schedule_challenge_timeout(bot, challenge['challenge_id'], challenge['chat_id'],
+                                   challenge.get('message_id'), created + config.CHALLENGE_TIMEOUT)
+        restored += 1
+    return restored
+
+# ============ LIFECYCLE ============
+async def on_startup(app: Application):
+    """One-time setup before updates are processed"""
+    await settings_cache.load()
+    settings_cache.start()
+    
+    for collection, name, seconds in await db.ensure_indexes():
+        logger.info(f"Index {collection}.{name} ready in {seconds * 1000:.0f} ms")
+    
+    migrated = await db.migrate_active_games()
+    if migrated:
+        logger.info(f"Migrated {migrated} legacy game sessions")
+    
+    await leaderboard.seed()
     
-    # Back to Menu
-    elif data == "menu":
-        await start_command(update, context)
+    loaded = await game_store.load()
+    logger.info(f"Loaded {loaded} active games")
+    game_store.start()
+    
+    restored = await restore_timers(app.bot)
+    logger.info(f"Restored {restored} move/challenge deadlines")
+    timers.start()
+    
+    resumed = await broadcaster.resume_all(app.bot)
+    if resumed:
+        logger.info(f"Resumed {resumed} broadcasts")
+    stats_writer.start()
+
+async def on_shutdown(app: Application):
+    """Release background resources"""
+    ai_pool.shutdown()
+    await broadcaster.stop()
+    await timers.stop()
+    await settings_cache.stop()
+    await game_store.stop()
+    await stats_writer.stop()
+    db.close()
 
 # ============ MAIN FUNCTION ============
 def main():
     """Start the bot"""
     # Create application
-    app = Application.builder().token(config.BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .rate_limiter(outbox.get_limiter())
+        .concurrent_updates(config.UPDATE_WORKERS)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Add handlers
     app.add_handler(CommandHandler("start", start_command))
@@ -241,6 +511,10 @@ def main():
     app.add_handler(CommandHandler("admin", admin.admin_panel))
     app.add_handler(CommandHandler("setforcesub", admin.set_forcesub))
     app.add_handler(CommandHandler("broadcast", admin.broadcast))
+    app.add_handler(CommandHandler("poolstats", admin.pool_stats))
+    app.add_handler(CommandHandler("cachestats", admin.cache_stats))
+    app.add_handler(CommandHandler("outboxstats", admin.outbox_stats))
+    app.add_handler(CommandHandler("routestats", admin.route_stats))
     
     # Start bot
     if config.WEBHOOK_URL:
@@ -0,0 +1,138 @@
+"""
+BROADCASTER - Resumable broadcast jobs
+
+Users are streamed in user_id order, BROADCAST_BATCH at a time, and each
+batch is sent with up to BROADCAST_CONCURRENCY messages in flight (the
+outbox keeps the actual rate within Telegram's limits). After every batch
+the job's cursor and counters are checkpointed in the `broadcasts`
+collection, so a job interrupted by a restart resumes after the last
+finished batch. Users who blocked the bot are marked and skipped by later
+broadcasts. The admin's status message shows live progress.
+"""
+
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+import config
+import database as db
+import edits
+import outbox
+import user_cache
+import utils
+
+logger = logging.getLogger(__name__)
+
+_jobs = {}  # job_id -> running task
+
+async def start(bot, text, chat_id):
+    """Create a job and start sending; returns the job ID"""
+    job_id = utils.generate_game_id()
+    total = await db.count_reachable_users()
+    status = await bot.send_message(chat_id, f"📣 Broadcast {job_id} starting for {total} users...")
+    job = {
+        'job_id': job_id,
+        'text': text,
+        'chat_id': chat_id,
+        'message_id': status.message_id,
+        'cursor': None,    # Last user_id of the last finished batch
+        'total': total,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'elapsed': 0.0,    # Sending time over all runs, for throughput
+        'status': 'running',
+    }
+    await db.create_broadcast(job)
+    _spawn(bot, job)
+    return job_id
+
+async def resume_all(bot):
+    """Restart jobs left running by a previous process, returns how many"""
+    jobs = await db.get_running_broadcasts()
+    for job in jobs:
+        _spawn(bot, job)
+    return len(jobs)
+
+def _spawn(bot, job):
+    task = asyncio.get_running_loop().create_task(_run(bot, job))
+    _jobs[job['job_id']] = task
+    task.add_done_callback(lambda _: _jobs.pop(job['job_id'], None))
+
+async def stop():
+    """Cancel running jobs; they resume from their checkpoint on next boot"""
+    for task in list(_jobs.values()):
+        task.cancel()
+    await asyncio.gather(*_jobs.values(), return_exceptions=True)
+
+async def _run(bot, job):
+    limit = asyncio.Semaphore(config.BROADCAST_CONCURRENCY)
+    run_started = time.monotonic()
+    elapsed_before = job['elapsed']
+
+    async def send(user_id):
+        async with limit:
+            for _ in range(3):
+                try:
+                    await bot.send_message(user_id, job['text'], rate_limit_args=outbox.BULK)
+                    job['sent'] += 1
+                    return False
+                except RetryAfter as e:
+                    # The outbox already retried; back off once more ourselves
+                    await asyncio.sleep(float(e.retry_after))
+                except Forbidden:
+                    job['blocked'] += 1
+                    return True
+                except Exception as e:
+                    logger.debug(f"Broadcast {job['job_id']} to {user_id} failed: {e!r}")
+                    break
+            job['failed'] += 1
+            return False
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(config.BROADCAST_PROGRESS_INTERVAL)
+            job['elapsed'] = elapsed_before + time.monotonic() - run_started
+            await _report(bot, job)
+
+    reporter = asyncio.get_running_loop().create_task(report_progress())
+    try:
+        while True:
+            user_ids = await db.get_user_id_batch(job['cursor'], config.BROADCAST_BATCH)
+            if not user_ids:
+                break
+            blocked = await asyncio.gather(*(send(user_id) for user_id in user_ids))
+            blocked = [user_id for user_id, is_blocked in zip(user_ids, blocked) if is_blocked]
+            if blocked:
+                await db.mark_users_blocked(blocked)
+                # Their next /start must reach add_user to clear the flag
+                user_cache.forget(blocked)
+
+            # Checkpoint: a restart resends at most the batch in progress
+            job['cursor'] = user_ids[-1]
+            job['elapsed'] = elapsed_before + time.monotonic() - run_started
+            await db.update_broadcast(job['job_id'], _progress_fields(job))
+
+        job['status'] = 'done'
+        job['elapsed'] = elapsed_before + time.monotonic() - run_started
+        await db.update_broadcast(job['job_id'], {**_progress_fields(job), 'status': 'done'})
+        reporter.cancel()
+        await _report(bot, job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Broadcast {job['job_id']} stopped: {e!r}")
+    finally:
+        reporter.cancel()
+
+def _progress_fields(job):
+    return {key: job[key] for key in ('cursor', 'sent', 'failed', 'blocked', 'elapsed')}
+
+async def _report(bot, job):
+    """Edit the admin's status message with the current progress"""
+    try:
+        await edits.edit(bot, job['chat_id'], job['message_id'], utils.format_broadcast_progress(job))
+    except Exception as e:
+        logger.warning(f"Broadcast progress edit failed: {e!r}")
@@ -12,6 +12,16 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 
 # MongoDB
 MONGO_URL = os.getenv('MONGO_URL')
+MONGO_POOL_SIZE = int(os.getenv('MONGO_POOL_SIZE', 20))  # Also the I/O thread count
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 2))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+# How long an operation may wait for a free pooled connection
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+
+# Updates handled at once (handlers touching the same game still take turns)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 64))
 
 # Telegram Log Group
 LOG_GROUP_ID = os.getenv('LOG_GROUP_ID')
@@ -19,14 +29,68 @@ LOG_GROUP_ID = os.getenv('LOG_GROUP_ID')
 # Admin IDs
 ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x]
 
-# Forcesub (dynamic from database)
+# Forcesub (dynamic from database, kept in sync by settings_cache)
 FORCESUB_ENABLED = False
 FORCESUB_CHANNEL = None
+SETTINGS_POLL_INTERVAL = float(os.getenv('SETTINGS_POLL_INTERVAL', 15))  # seconds
+# Cached membership checks: members are re-checked less often than
+# non-members, who may join at any moment
+MEMBER_CACHE_TTL = int(os.getenv('MEMBER_CACHE_TTL', 600))
+NONMEMBER_CACHE_TTL = int(os.getenv('NONMEMBER_CACHE_TTL', 60))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', 50000))
+# A "no" this recent is reused even when "I've joined" is pressed (button spam)
+MEMBERSHIP_RECHECK_GRACE = float(os.getenv('MEMBERSHIP_RECHECK_GRACE', 5))  # seconds
 
 # Game Settings
 MOVE_TIMEOUT = 30  # seconds
 CHALLENGE_TIMEOUT = 60  # seconds
 
+# Outgoing Telegram requests (token buckets: rate per second, burst)
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', 30))
+OUTBOX_GLOBAL_BURST = int(os.getenv('OUTBOX_GLOBAL_BURST', 30))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', 1))          # private chats
+OUTBOX_CHAT_BURST = int(os.getenv('OUTBOX_CHAT_BURST', 3))
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', 20 / 60))  # groups: 20 per minute
+OUTBOX_GROUP_BURST = int(os.getenv('OUTBOX_GROUP_BURST', 3))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', 3))  # Retries after a 429
+
+# Bot AI pool
+AI_EXECUTOR = os.getenv('AI_EXECUTOR', 'thread')  # thread or process
+AI_WORKERS = int(os.getenv('AI_WORKERS', 2))
+AI_MOVE_BUDGET = float(os.getenv('AI_MOVE_BUDGET', 2.0))  # seconds per bot move
+# Search time for large-board impossible bots: a slice of the player's move
+# timeout, kept under AI_MOVE_BUDGET so the pool fallback stays a fallback
+AI_SEARCH_TIME = min(MOVE_TIMEOUT / 20, AI_MOVE_BUDGET * 0.75)
+# Collect 3x3 bot moves for this long and resolve them in one vectorized
+# pass (0 = off, every move goes to the pool on its own)
+AI_BATCH_WINDOW_MS = float(os.getenv('AI_BATCH_WINDOW_MS', 0))
+
+# Persisted games untouched this long are dropped by a TTL index (seconds)
+ACTIVE_GAME_IDLE_TTL = int(os.getenv('ACTIVE_GAME_IDLE_TTL', 24 * 3600))
+
+# Live games are kept in memory and written behind this often (seconds)
+GAME_FLUSH_INTERVAL = float(os.getenv('GAME_FLUSH_INTERVAL', 5))
+
+# Finished games are written in bulk every STATS_FLUSH_MS, or once
+# STATS_FLUSH_OPS results are queued; at STATS_QUEUE_MAX new results wait
+STATS_FLUSH_MS = float(os.getenv('STATS_FLUSH_MS', 250))
+STATS_FLUSH_OPS = int(os.getenv('STATS_FLUSH_OPS', 200))
+STATS_QUEUE_MAX = int(os.getenv('STATS_QUEUE_MAX', 2000))
+
+# Known users kept in memory; /start re-writes a cached, unchanged profile
+# only once its last_active is this old (seconds)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 50000))
+USER_ACTIVE_GRANULARITY = int(os.getenv('USER_ACTIVE_GRANULARITY', 3600))
+
+# Players shown on /leaderboard (kept in memory)
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 10))
+
+# Broadcasts: users per checkpointed batch, sends in flight, seconds
+# between progress updates to the admin
+BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', 500))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', 30))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 5))
+
 # Points System
 POINTS_WIN = 25
 POINTS_LOSS = 5
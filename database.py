@@ -3,21 +3,100 @@ DATABASE - MongoDB operations
 """
 
 import os
-from datetime import datetime
-from pymongo import MongoClient
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import MongoClient, ReplaceOne, UpdateOne, DeleteMany, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 import config
+from game import GameSession, SESSION_VERSION
+
+logger = logging.getLogger(__name__)
 
 # MongoDB connection
-client = MongoClient(config.MONGO_URL)
+client = MongoClient(
+    config.MONGO_URL,
+    maxPoolSize=config.MONGO_POOL_SIZE,
+    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+    connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS,
+    serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 db = client['tictactoe_arena']
 
+# Dedicated I/O threads, one per pooled connection: pymongo calls run here
+# so a slow round trip never stalls the event loop
+_io = ThreadPoolExecutor(max_workers=config.MONGO_POOL_SIZE, thread_name_prefix='mongo')
+
+def _offload(func):
+    """Make a blocking pymongo operation awaitable on the I/O executor"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_io, functools.partial(func, *args, **kwargs))
+    wrapper.sync = func  # Blocking version, for scripts and other threads
+    return wrapper
+
+def close():
+    """Finish queued operations and close the connection pool"""
+    _io.shutdown(wait=True)
+    client.close()
+
 # Collections
 users = db['users']
 active_games = db['active_games']
 game_history = db['game_history']
 settings = db['settings']
+broadcasts = db['broadcasts']
+
+# ============ INDEXES ============
+# (collection, keys, options); names are derived from the keys, so running
+# this again is a no-op unless an option changed
+INDEXES = [
+    ('users', [('user_id', ASCENDING)], {'unique': True}),
+    ('users', [('points', DESCENDING)], {}),
+    ('active_games', [('game_id', ASCENDING)], {'unique': True}),
+    ('active_games', [('updated_at', ASCENDING)],
+     {'expireAfterSeconds': config.ACTIVE_GAME_IDLE_TTL}),
+    ('challenges', [('challenge_id', ASCENDING)], {'unique': True}),
+    ('broadcasts', [('job_id', ASCENDING)], {'unique': True}),
+    ('broadcasts', [('status', ASCENDING)], {}),
+    ('challenges', [('created_at', ASCENDING)],
+     {'expireAfterSeconds': config.CHALLENGE_TIMEOUT}),
+]
+
+@_offload
+def ensure_indexes():
+    """Create missing indexes, returns [(collection, index name, seconds)]
+
+    A changed TTL is applied in place with collMod. Any other conflict
+    (e.g. duplicate user_ids blocking a unique index) is logged and
+    skipped so the bot still starts.
+    """
+    report = []
+    for collection, keys, options in INDEXES:
+        started = time.perf_counter()
+        try:
+            name = db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            name = '_'.join(f"{field}_{direction}" for field, direction in keys)
+            if 'expireAfterSeconds' in options and e.code in (85, 86):  # Options conflict
+                db.command('collMod', collection, index={
+                    'keyPattern': dict(keys),
+                    'expireAfterSeconds': options['expireAfterSeconds'],
+                })
+            else:
+                logger.error(f"Index {collection}.{name} not created: {e}")
+                continue
+        report.append((collection, name, time.perf_counter() - started))
+    return report
 
 # ============ USER OPERATIONS ============
+@_offload
 def add_user(user_id, username, first_name):
     """Add new user or update existing"""
     users.update_one(
@@ -26,7 +105,8 @@ def add_user(user_id, username, first_name):
             '$set': {
                 'username': username,
                 'first_name': first_name,
-                'last_active': datetime.now()
+                'last_active': datetime.now(),
+                'blocked': False
             },
             '$setOnInsert': {
                 'points': 0,
@@ -41,49 +121,166 @@ def add_user(user_id, username, first_name):
         upsert=True
     )
 
+@_offload
 def get_user_stats(user_id):
     """Get user statistics"""
     return users.find_one({'user_id': user_id})
 
+def stats_update(results, now=None):
+    """Update document applying game results (in order) to one user
+
+    Draws leave the streak alone and a loss resets it. Without wins this is
+    a plain $inc; with wins it is a pipeline, so best_streak can be
+    compared ($max) with the streak values the same update produces.
+    """
+    now = now or datetime.now()
+    wins = results.count('win')
+    losses = results.count('loss')
+    draws = results.count('draw')
+    points = wins * config.POINTS_WIN + losses * config.POINTS_LOSS + draws * config.POINTS_DRAW
+
+    # Win runs separated by losses: the first extends the stored streak,
+    # the last one is the new streak if there was any loss
+    runs = [0]
+    for result in results:
+        if result == 'win':
+            runs[-1] += 1
+        elif result == 'loss':
+            runs.append(0)
+
+    if not wins:
+        counts = {'losses': losses, 'draws': draws, 'points': points}
+        update = {
+            '$inc': {field: amount for field, amount in counts.items() if amount},
+            '$set': {'last_active': now},
+        }
+        if losses:
+            update['$set']['streak'] = 0
+        return update
+
+    def add(field, amount):
+        return {'$add': [{'$ifNull': [f'${field}', 0]}, amount]}
+
+    update = [
+        {'$set': {
+            'wins': add('wins', wins),
+            'losses': add('losses', losses),
+            'draws': add('draws', draws),
+            'points': add('points', points),
+            'streak': add('streak', runs[0]),
+            'last_active': now,
+        }},
+        {'$set': {'best_streak': {'$max': [{'$ifNull': ['$best_streak', 0]}, '$streak', max(runs[1:], default=0)]}}},
+    ]
+    if len(runs) > 1:
+        update.append({'$set': {'streak': runs[-1]}})
+    return update
+
+@_offload
 def update_user_stats(user_id, result):
-    """Update user stats after game"""
-    update_data = {'last_active': datetime.now()}
-    
-    if result == 'win':
-        update_data['wins'] = {'$inc': 1}
-        update_data['points'] = {'$inc': 25}
-        update_data['streak'] = {'$inc': 1}
-    elif result == 'loss':
-        update_data['losses'] = {'$inc': 1}
-        update_data['points'] = {'$inc': 5}
-        update_data['streak'] = 0
-    else:  # draw
-        update_data['draws'] = {'$inc': 1}
-        update_data['points'] = {'$inc': 10}
-    
-    users.update_one({'user_id': user_id}, update_data)
+    """Apply a game result atomically, returns the updated user (or None)"""
+    return users.find_one_and_update(
+        {'user_id': user_id},
+        stats_update([result]),
+        projection={'_id': 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+@_offload
+def apply_stats_batch(results_by_user):
+    """Write many users' results in one unordered bulk_write
 
+    A BulkWriteError is raised as is, its writeErrors indexes follow the
+    order of results_by_user.
+    """
+    now = datetime.now()
+    users.bulk_write([
+        UpdateOne({'user_id': user_id}, stats_update(results, now))
+        for user_id, results in results_by_user.items()
+    ], ordered=False)
+
+@_offload
+def get_users(user_ids):
+    """{user_id: user} for many users in one query"""
+    return {doc['user_id']: doc for doc in users.find({'user_id': {'$in': list(user_ids)}}, {'_id': 0})}
+
+@_offload
 def get_leaderboard(limit=10):
     """Get top players"""
     return list(users.find().sort('points', -1).limit(limit))
 
+@_offload
+def count_reachable_users():
+    """Users not known to have blocked the bot"""
+    return users.count_documents({'blocked': {'$ne': True}})
+
+@_offload
+def get_user_id_batch(after=None, limit=500):
+    """Next reachable user IDs in user_id order, after `after`"""
+    query = {'blocked': {'$ne': True}}
+    if after is not None:
+        query['user_id'] = {'$gt': after}
+    cursor = users.find(query, {'user_id': 1, '_id': 0}).sort('user_id', ASCENDING).limit(limit)
+    return [doc['user_id'] for doc in cursor]
+
+@_offload
+def mark_users_blocked(user_ids):
+    """Skip these users in future broadcasts (cleared when they /start again)"""
+    users.update_many({'user_id': {'$in': list(user_ids)}}, {'$set': {'blocked': True}})
+
 # ============ GAME OPERATIONS ============
+@_offload
 def save_active_game(game_session):
-    """Save active game to database"""
+    """Save active game to database (compact encoded form)"""
     active_games.replace_one(
-        {'game_id': game_session['game_id']},
-        game_session,
+        {'game_id': game_session.game_id},
+        {**game_session.encode(), 'updated_at': datetime.now(timezone.utc)},
         upsert=True
     )
 
+@_offload
 def get_active_game(game_id):
     """Get active game by ID"""
-    return active_games.find_one({'game_id': game_id})
+    doc = active_games.find_one({'game_id': game_id}, {'_id': 0, 'updated_at': 0})
+    return GameSession.decode(doc) if doc else None
+
+@_offload
+def save_active_games(docs, deleted_ids=()):
+    """Upsert encoded games and delete finished ones in one round trip"""
+    # updated_at drives the idle TTL index
+    now = datetime.now(timezone.utc)
+    requests = [ReplaceOne({'game_id': doc['game_id']}, {**doc, 'updated_at': now}, upsert=True)
+                for doc in docs]
+    if deleted_ids:
+        requests.append(DeleteMany({'game_id': {'$in': list(deleted_ids)}}))
+    if requests:
+        active_games.bulk_write(requests, ordered=False)
+
+@_offload
+def load_active_games():
+    """Every persisted game, decoded"""
+    return [GameSession.decode(doc) for doc in active_games.find({}, {'_id': 0, 'updated_at': 0})]
+
+@_offload
+def migrate_active_games():
+    """Rewrite legacy dict-style game documents in the compact form"""
+    # updated_at drives the idle TTL index; the idle clock starts now
+    now = datetime.now(timezone.utc)
+    migrated = 0
+    for doc in active_games.find({'v': {'$ne': SESSION_VERSION}}):
+        active_games.replace_one({'_id': doc['_id']},
+                                 {**GameSession.decode(doc).encode(), 'updated_at': now})
+        migrated += 1
+    # Games migrated before updated_at was written would never expire
+    active_games.update_many({'updated_at': {'$exists': False}}, {'$set': {'updated_at': now}})
+    return migrated
 
+@_offload
 def delete_active_game(game_id):
     """Delete active game"""
     active_games.delete_one({'game_id': game_id})
 
+@_offload
 def save_game_history(game_data):
     """Save completed game to history"""
     game_history.insert_one({
@@ -91,33 +288,73 @@ def save_game_history(game_data):
         'timestamp': datetime.now()
     })
 
+@_offload
+def save_game_history_batch(docs):
+    """Save many completed games in one insert_many"""
+    now = datetime.now()
+    game_history.insert_many([{**doc, 'timestamp': now} for doc in docs], ordered=False)
+
 # ============ CHALLENGE OPERATIONS ============
-def create_challenge(challenge_id, challenger_id, chat_id):
+@_offload
+def create_challenge(challenge_id, challenger_id, chat_id, message_id=None):
     """Create new challenge"""
     db['challenges'].insert_one({
         'challenge_id': challenge_id,
         'challenger_id': challenger_id,
         'chat_id': chat_id,
-        'created_at': datetime.now()
+        'message_id': message_id,
+        'created_at': datetime.now(timezone.utc)  # TTL index expects UTC
     })
 
+@_offload
 def get_challenge(challenge_id):
     """Get challenge by ID"""
     return db['challenges'].find_one({'challenge_id': challenge_id})
 
+@_offload
+def get_open_challenges():
+    """Every stored challenge (for re-arming expiry timers)"""
+    return list(db['challenges'].find({}, {'_id': 0}))
+
+@_offload
 def delete_challenge(challenge_id):
-    """Delete challenge"""
-    db['challenges'].delete_one({'challenge_id': challenge_id})
+    """Delete challenge, returns whether it was still open"""
+    return db['challenges'].delete_one({'challenge_id': challenge_id}).deleted_count > 0
+
+# ============ BROADCAST OPERATIONS ============
+@_offload
+def create_broadcast(job):
+    """Store a new broadcast job"""
+    broadcasts.insert_one({**job, 'created_at': datetime.now()})
+
+@_offload
+def update_broadcast(job_id, fields):
+    """Checkpoint a broadcast job's progress"""
+    broadcasts.update_one({'job_id': job_id}, {'$set': {**fields, 'updated_at': datetime.now()}})
+
+@_offload
+def get_running_broadcasts():
+    """Jobs that were still sending when the last process stopped"""
+    return list(broadcasts.find({'status': 'running'}, {'_id': 0}))
 
 # ============ SETTINGS OPERATIONS ============
+@_offload
 def get_settings():
     """Get bot settings"""
     return settings.find_one() or {}
 
-def update_settings(key, value):
-    """Update settings"""
-    settings.update_one(
+@_offload
+def update_settings(values):
+    """Set several settings at once, bumping the version; returns the new doc"""
+    return settings.find_one_and_update(
         {},
-        {'$set': {key: value}},
-        upsert=True
+        {'$set': values, '$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
+
+@_offload
+def get_settings_version():
+    """Settings version only (cheap change check)"""
+    doc = settings.find_one({}, {'version': 1, '_id': 0})
+    return (doc or {}).get('version', 0)
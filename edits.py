@@ -0,0 +1,122 @@
+"""
+EDITS - Board message edits without redundant API calls
+
+Remembers a digest of the text and keyboard last sent to each message.
+An edit identical to it is skipped (Telegram would reject it as "message
+is not modified"). While an edit of a message is in flight, newer edits
+of it wait in a single slot: each replaces the one before, so a burst of
+taps ends in one request carrying the latest state.
+"""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+from telegram.error import BadRequest
+
+# Messages whose last content is remembered
+MAX_TRACKED = 50000
+
+_sent = OrderedDict()  # (chat_id, message_id) -> (text digest, markup digest)
+_inflight = set()      # messages with an edit on its way
+_pending = {}          # message -> (text, reply_markup, future) waiting behind it
+
+# Edit metrics (read with get_metrics)
+_metrics = {
+    'sent': 0,
+    'skipped': 0,     # identical to what the message already shows
+    'collapsed': 0,   # replaced by a newer edit before it was sent
+}
+
+def _digest(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = value.to_json()
+    return hashlib.blake2b(value.encode(), digest_size=8).digest()
+
+def _unchanged(key, text, reply_markup):
+    last = _sent.get(key)
+    if last is None:
+        return False
+    text_same = text is None or _digest(text) == last[0]
+    return text_same and _digest(reply_markup) == last[1]
+
+def _remember(key, text, reply_markup):
+    last = _sent.get(key, (None, None))
+    _sent[key] = (_digest(text) if text is not None else last[0], _digest(reply_markup))
+    _sent.move_to_end(key)
+    while len(_sent) > MAX_TRACKED:
+        _sent.popitem(last=False)
+
+def forget(chat_id, message_id):
+    """Message content changed elsewhere (or was deleted)"""
+    _sent.pop((chat_id, message_id), None)
+
+async def edit(bot, chat_id, message_id, text=None, reply_markup=None):
+    """Show text/reply_markup on a message (text=None edits the keyboard only)
+
+    Returns True once the message shows this state, False if the edit was
+    skipped as a no-op or superseded by a newer one.
+    """
+    key = (chat_id, message_id)
+    if key in _inflight:
+        previous = _pending.get(key)
+        if previous is not None:
+            _metrics['collapsed'] += 1
+            _resolve(previous[2], False)
+        future = asyncio.get_running_loop().create_future()
+        _pending[key] = (text, reply_markup, future)
+        return await future
+
+    if _unchanged(key, text, reply_markup):
+        _metrics['skipped'] += 1
+        return False
+
+    _inflight.add(key)
+    try:
+        try:
+            await _send(bot, key, text, reply_markup)
+        finally:
+            # Drain the slot: whatever waited there is the latest state
+            while key in _pending:
+                text, reply_markup, future = _pending.pop(key)
+                if _unchanged(key, text, reply_markup):
+                    _metrics['skipped'] += 1
+                    _resolve(future, False)
+                    continue
+                try:
+                    await _send(bot, key, text, reply_markup)
+                    _resolve(future, True)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+    finally:
+        # Never leave the message locked, or later edits would wait forever
+        _inflight.discard(key)
+    return True
+
+def _resolve(future, result):
+    # The waiting handler may have been cancelled meanwhile
+    if not future.done():
+        future.set_result(result)
+
+async def _send(bot, key, text, reply_markup):
+    chat_id, message_id = key
+    try:
+        if text is None:
+            await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id,
+                                                reply_markup=reply_markup)
+        else:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
+                                        text=text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            forget(chat_id, message_id)
+            raise
+    _metrics['sent'] += 1
+    _remember(key, text, reply_markup)
+
+def get_metrics():
+    """Edits sent, skipped and collapsed"""
+    return {**_metrics, 'tracked': len(_sent), 'in_flight': len(_inflight)}
@@ -0,0 +1,249 @@
+"""
+SEARCH ENGINE - Negamax with alpha-beta, transposition table, symmetry
+"""
+
+import time
+
+# Transposition table flags
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Nodes between wall-clock checks
+_CLOCK_INTERVAL = 1024
+
+class SearchTimeout(Exception):
+    """Deadline passed mid-iteration"""
+
+def symmetries(size):
+    """The 8 rotations/reflections of a size x size board as cell maps
+
+    perm[i] is where cell i lands under the transform.
+    """
+    last = size - 1
+    transforms = [
+        lambda r, c: (r, c),
+        lambda r, c: (c, last - r),
+        lambda r, c: (last - r, last - c),
+        lambda r, c: (last - c, r),
+        lambda r, c: (r, last - c),
+        lambda r, c: (last - r, c),
+        lambda r, c: (c, r),
+        lambda r, c: (last - c, last - r),
+    ]
+    perms = []
+    for transform in transforms:
+        perm = []
+        for cell in range(size * size):
+            r, c = transform(*divmod(cell, size))
+            perm.append(r * size + c)
+        perms.append(perm)
+    return perms
+
+def _byte_tables(perm, cells):
+    """Per-byte lookup tables so a mask transforms in one lookup per 8 cells"""
+    tables = []
+    for offset in range(0, cells, 8):
+        table = []
+        for byte in range(256):
+            mask = 0
+            for bit in range(8):
+                if byte >> bit & 1 and offset + bit < cells:
+                    mask |= 1 << perm[offset + bit]
+            table.append(mask)
+        tables.append(table)
+    return tables
+
+class _SearchState:
+    """Counters and deadline of one search call
+
+    Kept off the Searcher, which is shared by the pool's threads.
+    """
+
+    __slots__ = ('nodes', 'tt_hits', 'deadline')
+
+    def __init__(self, deadline):
+        self.nodes = 0
+        self.tt_hits = 0
+        self.deadline = deadline
+
+class Searcher:
+    """Negamax searcher for one board geometry
+
+    Scores are from the side to move: a win is worth 1 + empty cells left
+    when it lands (faster wins and slower losses are preferred), 0 is a
+    draw. Depth-limited leaves get a heuristic strictly inside (-1, 1), so
+    a proven result always outranks a guess. Positions equal under
+    rotation/reflection share one table entry.
+    """
+
+    def __init__(self, size, win_masks, tt_limit=1_000_000):
+        self.size = size
+        self.cells = size * size
+        self.win_masks = list(win_masks)
+        # Lines through each cell, so a win check only looks at the last move
+        self.cell_lines = [[m for m in self.win_masks if m >> cell & 1]
+                           for cell in range(self.cells)]
+        # Try cells on many lines (centre, then corners) first
+        self.move_order = sorted(range(self.cells), key=lambda c: -len(self.cell_lines[c]))
+        self.perms = symmetries(size)
+        self.inverse = [[perm.index(cell) for cell in range(self.cells)] for perm in self.perms]
+        self._tables = [_byte_tables(perm, self.cells) for perm in self.perms]
+        # Open-line weights: a line holding n of one side's marks is worth 4**n
+        self.k = max(m.bit_count() for m in self.win_masks)
+        self._eval_scale = len(self.win_masks) * 4 ** self.k + 1
+        # Shared by concurrent searches; per-search state is a _SearchState
+        self.tt = {}
+        self.tt_limit = tt_limit
+
+    # ============ HELPERS ============
+    def _transform(self, tables, mask):
+        result = 0
+        for table in tables:
+            result |= table[mask & 0xFF]
+            mask >>= 8
+        return result
+
+    def canonical(self, own, other):
+        """(key, symmetry index) of the smallest equivalent position"""
+        best_key = None
+        best_index = 0
+        for index, tables in enumerate(self._tables):
+            key = self._transform(tables, own) | self._transform(tables, other) << self.cells
+            if best_key is None or key < best_key:
+                best_key, best_index = key, index
+        return best_key, best_index
+
+    def _completes_line(self, mask, cell):
+        for line in self.cell_lines[cell]:
+            if mask & line == line:
+                return True
+        return False
+
+    def evaluate(self, own, other):
+        """Heuristic for the side to move, strictly between -1 and 1"""
+        score = 0
+        for line in self.win_masks:
+            mine = own & line
+            theirs = other & line
+            if mine and not theirs:
+                score += 4 ** mine.bit_count()
+            elif theirs and not mine:
+                score -= 4 ** theirs.bit_count()
+        return score / self._eval_scale
+
+    # ============ SEARCH ============
+    def _negamax(self, state, own, other, last, depth, alpha, beta):
+        state.nodes += 1
+        if state.deadline is not None and not state.nodes % _CLOCK_INTERVAL:
+            if time.perf_counter() > state.deadline:
+                raise SearchTimeout()
+        occupied = own | other
+        empties = self.cells - occupied.bit_count()
+
+        # Terminal: the previous mover just completed a line, or board full
+        if last is not None and self._completes_line(other, last):
+            return -(empties + 1)
+        if not empties:
+            return 0
+        if depth <= 0:
+            return self.evaluate(own, other)
+
+        alpha_orig = alpha
+        key, sym = self.canonical(own, other)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, flag, entry_score, entry_move = entry
+            if entry_depth >= depth:
+                state.tt_hits += 1
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER:
+                    alpha = max(alpha, entry_score)
+                else:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+            tt_move = self.inverse[sym][entry_move]
+
+        best_score = -float('inf')
+        best_move = None
+        for move in self._ordered_moves(occupied, tt_move):
+            score = -self._negamax(state, other, own | 1 << move, move, depth - 1, -beta, -alpha)
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt[key] = (depth, flag, best_score, self.perms[sym][best_move])
+        return best_score
+
+    def _ordered_moves(self, occupied, first=None):
+        if first is not None:
+            yield first
+        for cell in self.move_order:
+            if cell != first and not occupied >> cell & 1:
+                yield cell
+
+    def _search_root(self, state, own, other, depth, first=None):
+        occupied = own | other
+        best_score = -float('inf')
+        best_move = None
+        alpha, beta = -float('inf'), float('inf')
+        for move in self._ordered_moves(occupied, first):
+            score = -self._negamax(state, other, own | 1 << move, move, depth - 1, -beta, -alpha)
+            if score > best_score:
+                best_score, best_move = score, move
+                alpha = max(alpha, score)
+        return best_move, best_score
+
+    def search(self, own, other, max_time=None, max_depth=None):
+        """Best move for the side owning `own`, with search statistics
+
+        Iterative deepening: each depth is searched in full and reused to
+        order the next one. With max_time (seconds) the last completed
+        depth is returned once the wall clock runs out.
+        """
+        if len(self.tt) > self.tt_limit:
+            self.tt.clear()
+        started = time.perf_counter()
+        state = _SearchState(started + max_time if max_time is not None else None)
+
+        empties = self.cells - (own | other).bit_count()
+        remaining = empties if max_depth is None else min(empties, max_depth)
+        best_move, best_score, completed = None, None, 0
+        try:
+            for depth in range(1, remaining + 1):
+                best_move, best_score = self._search_root(state, own, other, depth, best_move)
+                completed = depth
+                # A proven result may come from a table bound left by an earlier
+                # search; stop only once this depth reaches the plies it takes,
+                # so no faster win (or slower loss) is left unsearched
+                if abs(best_score) >= 1 and empties - (abs(best_score) - 1) <= depth:
+                    break
+        except SearchTimeout:
+            pass
+
+        if best_move is None:
+            # Out of time before depth 1 finished: first ordered legal move
+            best_move = next(self._ordered_moves(own | other))
+            best_score = 0
+
+        elapsed = time.perf_counter() - started
+        return {
+            'move': best_move,
+            'score': best_score,
+            'depth': completed,
+            'nodes': state.nodes,
+            'tt_hits': state.tt_hits,
+            'tt_size': len(self.tt),
+            'elapsed': elapsed,
+            'nps': state.nodes / elapsed if elapsed else 0.0,
+        }
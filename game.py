@@ -4,167 +4,430 @@ GAME LOGIC - Board, moves, win detection, AI
 
 import random
 
-# Board positions
+import config
+import engine
+import rules
+import ultimate
+
+# Board positions (classic 3x3; larger variants number cells the same way)
 #  0 | 1 | 2
 # -----------
 #  3 | 4 | 5
 # -----------
 #  6 | 7 | 8
 
-WIN_COMBINATIONS = [
-    [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Horizontal
-    [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Vertical
-    [0, 4, 8], [2, 4, 6]              # Diagonal
-]
+CLASSIC = rules.get_rules('3x3')
+WIN_COMBINATIONS = CLASSIC.win_lines
+
+# Bitboards: one int per side, bit i set = that side owns cell i
+WIN_MASKS = CLASSIC.win_masks
+FULL_MASK = CLASSIC.full_mask
+
+# ============ BITBOARD HELPERS ============
+def board_to_masks(board):
+    """Board list (0=empty, 1=X, 2=O) -> (x_mask, o_mask)"""
+    x_mask = o_mask = 0
+    for i, value in enumerate(board):
+        if value == 1:
+            x_mask |= 1 << i
+        elif value == 2:
+            o_mask |= 1 << i
+    return x_mask, o_mask
+
+def masks_to_board(x_mask, o_mask, cells=9):
+    """(x_mask, o_mask) -> board list, inverse of board_to_masks"""
+    return [1 if x_mask >> i & 1 else 2 if o_mask >> i & 1 else 0 for i in range(cells)]
+
+def get_rules(game_session):
+    """Rules for the session's variant"""
+    return game_session.rules
+
+def get_masks(game_session):
+    """Session bitboards (x_mask, o_mask)"""
+    return game_session.x_mask, game_session.o_mask
+
+def empty_cells(x_mask, o_mask):
+    """Positions not taken by either side (3x3)"""
+    free = FULL_MASK & ~(x_mask | o_mask)
+    return [i for i in range(9) if free >> i & 1]
+
+def mask_winner(x_mask, o_mask, game_rules=CLASSIC):
+    """Winning symbol and combo index, or (0, None)"""
+    index = game_rules.find_line(x_mask)
+    if index >= 0:
+        return 1, index
+    index = game_rules.find_line(o_mask)
+    if index >= 0:
+        return 2, index
+    return 0, None
+
+# ============ GAME SESSION ============
+# Compact codes for the stored form (append only: stored flags index these)
+DIFFICULTY_CODES = ['easy', 'medium', 'hard', 'impossible']
+TYPE_CODES = ['bot', 'pvp']
+STATUS_CODES = ['ongoing', 'finished']
+VARIANT_CODES = list(rules.VARIANTS)
+
+SESSION_VERSION = 2
+
+class GameSession:
+    """One live game: both sides packed into a single int
+
+    bits = x_mask | o_mask << cells. X (player1) always moves first, so
+    whose turn it is and the move count follow from the board itself.
+    last is the last cell played (-1 before the first move); the ultimate
+    variant needs it to know which board is next. deadline is when the
+    side to move forfeits (epoch seconds, 0 = none) and message the
+    (chat_id, message_id) showing the board, so a timeout can update it.
+    """
+
+    __slots__ = ('game_id', 'type', 'player1', 'player2', 'difficulty', 'status', 'rules', 'bits', 'last',
+                 'deadline', 'message')
+
+    def __init__(self, game_id, player1, player2='bot', difficulty='easy',
+                 variant=rules.DEFAULT_VARIANT, game_type='bot', status='ongoing', bits=0, last=-1,
+                 deadline=0, message=None):
+        self.game_id = game_id
+        self.type = game_type
+        self.player1 = player1
+        self.player2 = player2
+        self.difficulty = difficulty
+        self.status = status
+        self.rules = rules.get_rules(variant)
+        self.bits = bits
+        self.last = last
+        self.deadline = deadline
+        self.message = message
+
+    @property
+    def variant(self):
+        return self.rules.name
+
+    @property
+    def x_mask(self):
+        return self.bits & self.rules.full_mask
+
+    @property
+    def o_mask(self):
+        return self.bits >> self.rules.cells
 
-def create_game(game_id, player_id, difficulty='easy'):
+    @property
+    def board(self):
+        """Board list (0=empty, 1=X, 2=O), for rendering"""
+        return masks_to_board(self.x_mask, self.o_mask, self.rules.cells)
+
+    @property
+    def moves_count(self):
+        return self.bits.bit_count()
+
+    @property
+    def turn(self):
+        x_mask, o_mask = self.x_mask, self.o_mask
+        return self.player1 if x_mask.bit_count() == o_mask.bit_count() else self.player2
+
+    def copy(self):
+        return GameSession(self.game_id, self.player1, self.player2, self.difficulty,
+                           self.rules.name, self.type, self.status, self.bits, self.last,
+                           self.deadline, self.message)
+
+    def __reduce__(self):
+        # Small pickles for process-pool workers
+        return GameSession.decode, (self.encode(),)
+
+    def __repr__(self):
+        return f"GameSession({self.game_id!r}, {self.variant}, {self.difficulty}, bits={self.bits:#x})"
+
+    # ============ STORED FORM ============
+    def encode(self):
+        """Compact document for Mongo: short keys, board and enums as ints"""
+        flags = (VARIANT_CODES.index(self.rules.name)
+                 | DIFFICULTY_CODES.index(self.difficulty) << 4
+                 | TYPE_CODES.index(self.type) << 8
+                 | STATUS_CODES.index(self.status) << 10)
+        doc = {
+            'game_id': self.game_id,
+            'v': SESSION_VERSION,
+            'p': [self.player1, self.player2],
+            # BSON ints are 64-bit; bigger boards are stored as raw bytes
+            'b': self.bits if self.bits < 1 << 63 else self.bits.to_bytes(21, 'little'),
+            'f': flags,
+        }
+        if self.last >= 0:
+            doc['l'] = self.last
+        if self.deadline:
+            doc['d'] = self.deadline
+        if self.message:
+            doc['m'] = list(self.message)
+        return doc
+
+    @classmethod
+    def decode(cls, doc):
+        """Session from a stored document, either compact or legacy dict"""
+        if doc.get('v') != SESSION_VERSION:
+            return cls.from_legacy(doc)
+        flags = doc['f']
+        bits = doc['b']
+        if isinstance(bits, bytes):
+            bits = int.from_bytes(bits, 'little')
+        return cls(
+            doc['game_id'], doc['p'][0], doc['p'][1],
+            difficulty=DIFFICULTY_CODES[flags >> 4 & 0xF],
+            variant=VARIANT_CODES[flags & 0xF],
+            game_type=TYPE_CODES[flags >> 8 & 0x3],
+            status=STATUS_CODES[flags >> 10 & 0x1],
+            bits=bits,
+            last=doc.get('l', -1),
+            deadline=doc.get('d', 0),
+            message=tuple(doc['m']) if 'm' in doc else None,
+        )
+
+    @classmethod
+    def from_legacy(cls, doc):
+        """Migration shim: session dict as stored before GameSession existed"""
+        variant = doc.get('variant', rules.DEFAULT_VARIANT)
+        x_mask, o_mask = board_to_masks(doc['board'])
+        return cls(
+            doc['game_id'], doc['player1'], doc.get('player2', 'bot'),
+            difficulty=doc.get('difficulty', 'easy'),
+            variant=variant,
+            game_type=doc.get('type', 'bot'),
+            status=doc.get('status', 'ongoing'),
+            bits=x_mask | o_mask << rules.get_rules(variant).cells,
+        )
+
+def create_game(game_id, player_id, difficulty='easy', variant=rules.DEFAULT_VARIANT):
     """Create new game session"""
-    return {
-        'game_id': game_id,
-        'type': 'bot',
-        'player1': player_id,
-        'player2': 'bot',
-        'board': [0] * 9,  # 0=empty, 1=X, 2=O
-        'turn': player_id,
-        'difficulty': difficulty,
-        'moves_count': 0,
-        'status': 'ongoing'
-    }
+    return GameSession(game_id, player_id, 'bot', difficulty, variant)
 
 def make_move(game_session, position, player_id):
-    """Make a move on the board"""
+    """Make a move on the board, returning the resulting status
+
+    Only the lines through the played cell are checked; the result carries
+    the winning combo, so no separate check_game_status call is needed.
+    """
+    game_rules = game_session.rules
+    if game_rules is ultimate.RULES:
+        return ultimate.make_move(game_session, position, player_id)
+    bits = game_session.bits
+    cells = game_rules.cells
+    x_mask = bits & game_rules.full_mask
+    o_mask = bits >> cells
+    bit = 1 << position
+
     # Check if position is valid
-    if game_session['board'][position] != 0:
+    if not 0 <= position < cells or (x_mask | o_mask) & bit:
         return {'valid': False, 'message': 'Position occupied!'}
-    
-    # Make move
-    symbol = 1 if player_id == game_session['player1'] else 2
-    game_session['board'][position] = symbol
-    game_session['moves_count'] += 1
-    
-    # Switch turn
-    if game_session['turn'] == game_session['player1']:
-        game_session['turn'] = game_session['player2']
+
+    # Make move (turn follows from the board)
+    game_session.last = position
+    if player_id == game_session.player1:
+        x_mask |= bit
+        game_session.bits = bits | bit
+        mover_mask, mover = x_mask, game_session.player1
     else:
-        game_session['turn'] = game_session['player1']
-    
-    # Check game status
-    result = check_game_status(game_session)
-    
-    return {'valid': True, 'status': result['status'], 'winner': result.get('winner')}
+        o_mask |= bit
+        game_session.bits = bits | bit << cells
+        mover_mask, mover = o_mask, game_session.player2
+
+    # Check game status (only a line through this cell can be new)
+    combo = game_rules.line_through(mover_mask, position)
+    if combo is not None:
+        return {'valid': True, 'status': 'finished', 'winner': mover, 'combo': combo}
+    if x_mask | o_mask == game_rules.full_mask:
+        return {'valid': True, 'status': 'finished', 'winner': 'draw'}
+    return {'valid': True, 'status': 'ongoing', 'winner': None}
 
 def check_game_status(game_session):
     """Check if game is won, draw or ongoing"""
-    board = game_session['board']
-    
+    game_rules = get_rules(game_session)
+    if game_rules is ultimate.RULES:
+        return ultimate.check_game_status(game_session)
+    x_mask, o_mask = get_masks(game_session)
+
     # Check win
-    for combo in WIN_COMBINATIONS:
-        if board[combo[0]] == board[combo[1]] == board[combo[2]] != 0:
-            winner = game_session['player1'] if board[combo[0]] == 1 else game_session['player2']
-            return {'status': 'finished', 'winner': winner, 'combo': combo}
-    
+    symbol, index = mask_winner(x_mask, o_mask, game_rules)
+    if symbol:
+        winner = game_session.player1 if symbol == 1 else game_session.player2
+        return {'status': 'finished', 'winner': winner, 'combo': game_rules.win_lines[index]}
+
     # Check draw
-    if game_session['moves_count'] == 9:
+    if x_mask | o_mask == game_rules.full_mask:
         return {'status': 'finished', 'winner': 'draw'}
-    
+
     return {'status': 'ongoing'}
 
+# ============ BOT AI ============
 def get_bot_move(game_session):
     """Get bot's move based on difficulty"""
-    difficulty = game_session.get('difficulty', 'easy')
-    board = game_session['board']
-    
-    if difficulty == 'easy':
+    difficulty = game_session.difficulty
+    game_rules = get_rules(game_session)
+    x_mask, o_mask = get_masks(game_session)
+
+    if game_rules is ultimate.RULES:
+        # Monte Carlo tree search, playouts set by difficulty
+        return ultimate.get_bot_move(game_session, max_time=config.AI_SEARCH_TIME)
+
+    elif difficulty == 'easy':
         # Random move
-        empty_cells = [i for i in range(9) if board[i] == 0]
-        return random.choice(empty_cells)
-    
+        return random.choice(game_rules.empty_cells(x_mask, o_mask))
+
     elif difficulty == 'medium':
         # Try to block player wins, else random
-        move = find_blocking_move(board)
+        move = _winning_move(x_mask, o_mask, game_rules.win_masks)
         if move is not None:
             return move
-        empty_cells = [i for i in range(9) if board[i] == 0]
-        return random.choice(empty_cells)
-    
+        return random.choice(game_rules.empty_cells(x_mask, o_mask))
+
     elif difficulty == 'hard':
         # Try to win, then block, then random
-        move = find_winning_move(board, 2)  # Bot is O (2)
-        if move is not None:
-            return move
-        move = find_blocking_move(board)
-        if move is not None:
-            return move
-        empty_cells = [i for i in range(9) if board[i] == 0]
-        return random.choice(empty_cells)
-    
-    else:  # impossible
-        # Use minimax algorithm
-        return minimax_move(board)
+        return quick_move(game_session)
+
+    elif game_rules is CLASSIC:  # impossible
+        # Perfect play from the solved table
+        return random.choice(_optimal_moves(x_mask, o_mask))
+
+    else:  # impossible, larger boards
+        # Iterative deepening within the search time budget
+        return search_move(game_session, max_time=config.AI_SEARCH_TIME)['move']
+
+def quick_move(game_session):
+    """Cheap bot move: win, else block, else random (bot is O)"""
+    game_rules = get_rules(game_session)
+    if game_rules is ultimate.RULES:
+        return ultimate.quick_move(game_session)
+    x_mask, o_mask = get_masks(game_session)
+    move = _winning_move(o_mask, x_mask, game_rules.win_masks)
+    if move is not None:
+        return move
+    move = _winning_move(x_mask, o_mask, game_rules.win_masks)
+    if move is not None:
+        return move
+    return random.choice(game_rules.empty_cells(x_mask, o_mask))
+
+def _winning_move(own_mask, other_mask, win_masks=WIN_MASKS):
+    """Cell that completes a line for own_mask, or None"""
+    for mask in win_masks:
+        if not other_mask & mask and (own_mask & mask).bit_count() == mask.bit_count() - 1:
+            return (mask & ~own_mask).bit_length() - 1
+    return None
 
 def find_winning_move(board, symbol):
     """Find move that wins the game"""
-    for combo in WIN_COMBINATIONS:
-        values = [board[i] for i in combo]
-        if values.count(symbol) == 2 and values.count(0) == 1:
-            return combo[values.index(0)]
-    return None
+    x_mask, o_mask = board_to_masks(board)
+    if symbol == 1:
+        return _winning_move(x_mask, o_mask)
+    return _winning_move(o_mask, x_mask)
 
 def find_blocking_move(board):
     """Find move that blocks opponent win"""
     return find_winning_move(board, 1)  # Player is X (1)
 
 def minimax_move(board):
-    """Minimax algorithm for impossible difficulty"""
-    # Simplified version - always plays optimal
-    best_score = -float('inf')
-    best_move = None
-    
-    for i in range(9):
-        if board[i] == 0:
-            board[i] = 2  # Bot plays
-            score = minimax(board, False)
-            board[i] = 0  # Undo
-            
-            if score > best_score:
-                best_score = score
-                best_move = i
-    
-    return best_move
-
-def minimax(board, is_maximizing):
-    """Minimax recursive function"""
-    # Check terminal states
-    result = check_board_winner(board)
-    if result == 2:  # Bot wins
-        return 1
-    elif result == 1:  # Player wins
-        return -1
-    elif 0 not in board:  # Draw
-        return 0
-    
-    if is_maximizing:
-        best_score = -float('inf')
-        for i in range(9):
-            if board[i] == 0:
-                board[i] = 2
-                score = minimax(board, False)
-                board[i] = 0
-                best_score = max(score, best_score)
-        return best_score
+    """Perfect play for impossible difficulty (solved-table lookup)"""
+    return random.choice(get_optimal_moves(board))
+
+# ============ SEARCH ENGINE ============
+_searchers = {}
+
+def get_searcher(game_rules=CLASSIC):
+    """Alpha-beta searcher per variant (transposition table persists across games)"""
+    searcher = _searchers.get(game_rules.name)
+    if searcher is None:
+        searcher = _searchers[game_rules.name] = engine.Searcher(game_rules.size, game_rules.win_masks)
+    return searcher
+
+def search_move(game_session, max_time=None):
+    """Alpha-beta search result for the side to move: move, score, depth, nodes, nps"""
+    searcher = get_searcher(get_rules(game_session))
+    x_mask, o_mask = get_masks(game_session)
+    if x_mask.bit_count() == o_mask.bit_count():
+        return searcher.search(x_mask, o_mask, max_time=max_time)
+    return searcher.search(o_mask, x_mask, max_time=max_time)
+
+# ============ SOLVED TABLE ============
+# Every reachable position maps to (score, optimal_moves), keyed on the
+# packed bitboards x_mask | o_mask << 9. Scores are from the side to move:
+# a win is worth 1 + empty cells left when it lands, so faster wins score
+# higher and slower losses score less negative; 0 = draw.
+
+_solved = {}
+
+def _solve(x_mask, o_mask):
+    """Fill the solved table from this position down, return its score"""
+    key = x_mask | o_mask << 9
+    entry = _solved.get(key)
+    if entry is not None:
+        return entry[0]
+
+    free = FULL_MASK & ~(x_mask | o_mask)
+    empty_count = free.bit_count()
+    if mask_winner(x_mask, o_mask)[0]:
+        # Previous move won: side to move has lost
+        entry = (-(empty_count + 1), ())
+    elif not free:
+        entry = (0, ())
     else:
-        best_score = float('inf')
+        x_to_move = x_mask.bit_count() == o_mask.bit_count()
+        best_score = -float('inf')
+        best_moves = []
         for i in range(9):
-            if board[i] == 0:
-                board[i] = 1
-                score = minimax(board, True)
-                board[i] = 0
-                best_score = min(score, best_score)
-        return best_score
+            bit = 1 << i
+            if not free & bit:
+                continue
+            if x_to_move:
+                score = -_solve(x_mask | bit, o_mask)
+            else:
+                score = -_solve(x_mask, o_mask | bit)
+            if score > best_score:
+                best_score = score
+                best_moves = [i]
+            elif score == best_score:
+                best_moves.append(i)
+        entry = (best_score, tuple(best_moves))
+
+    _solved[key] = entry
+    return entry[0]
+
+def _optimal_moves(x_mask, o_mask):
+    """Optimal moves for the side to move, straight from bitboards"""
+    if not _solved:
+        _solve(0, 0)
+    entry = _solved.get(x_mask | o_mask << 9)
+    if entry is None:
+        _solve(x_mask, o_mask)
+        entry = _solved[x_mask | o_mask << 9]
+    return entry[1]
+
+def solution_table():
+    """Solved table for every reachable position (built once, on first use)"""
+    if not _solved:
+        _solve(0, 0)
+    return _solved
+
+def get_position_score(board):
+    """Perfect-play score of the position for the side to move"""
+    solution_table()
+    x_mask, o_mask = board_to_masks(board)
+    return _solve(x_mask, o_mask)
+
+def get_optimal_moves(board):
+    """All moves that keep perfect-play score for the side to move"""
+    return list(_optimal_moves(*board_to_masks(board)))
+
+def get_move_values(board):
+    """Perfect-play score of every legal move, for the side to move"""
+    solution_table()
+    x_mask, o_mask = board_to_masks(board)
+    x_to_move = x_mask.bit_count() == o_mask.bit_count()
+    values = {}
+    for i in empty_cells(x_mask, o_mask):
+        bit = 1 << i
+        if x_to_move:
+            values[i] = -_solve(x_mask | bit, o_mask)
+        else:
+            values[i] = -_solve(x_mask, o_mask | bit)
+    return values
 
 def check_board_winner(board):
-    """Quick check for winner (for minimax)"""
-    for combo in WIN_COMBINATIONS:
-        if board[combo[0]] == board[combo[1]] == board[combo[2]] != 0:
-            return board[combo[0]]
-    return 0
+    """Quick check for winner on a board list"""
+    return mask_winner(*board_to_masks(board))[0]
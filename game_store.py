@@ -0,0 +1,138 @@
+"""
+GAME STORE - Live games in memory, written behind to MongoDB
+
+The in-process dict is the source of truth for ongoing games: handlers
+read and update it with no database round trip. Changed and finished
+games are flushed to `active_games` in one batch every
+GAME_FLUSH_INTERVAL seconds and at shutdown, and reloaded on boot.
+"""
+
+import asyncio
+import logging
+import time
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+_games = {}       # game_id -> GameSession
+_dirty = set()    # game_ids saved since the last flush
+_deleted = set()  # game_ids finished since the last flush
+_flusher = None
+_flush_lock = asyncio.Lock()
+
+# Store metrics (read with get_metrics)
+_metrics = {
+    'flushes': 0,
+    'saved': 0,
+    'deleted': 0,
+    'failures': 0,
+    'flush_max': 0.0,
+}
+
+# ============ HOT PATH ============
+def get(game_id):
+    """Live game by ID, or None"""
+    return _games.get(game_id)
+
+def save(game_session):
+    """Store a new or updated game; persisted on the next flush"""
+    _games[game_session.game_id] = game_session
+    _dirty.add(game_session.game_id)
+    _deleted.discard(game_session.game_id)
+
+def delete(game_id):
+    """Drop a finished game; removed from the database on the next flush"""
+    _games.pop(game_id, None)
+    _dirty.discard(game_id)
+    _deleted.add(game_id)
+
+def sessions():
+    """Every live game"""
+    return list(_games.values())
+
+# ============ PERSISTENCE ============
+async def load():
+    """Reload games persisted by a previous process, returns the count"""
+    sessions = await db.load_active_games()
+    for session in sessions:
+        _games.setdefault(session.game_id, session)
+    return len(sessions)
+
+async def flush():
+    """Write every pending change in one batch, returns operations written"""
+    async with _flush_lock:
+        if not _dirty and not _deleted:
+            return 0
+        # Encode now: sessions keep changing while the write is in flight
+        dirty, deleted = set(_dirty), set(_deleted)
+        _dirty.clear()
+        _deleted.clear()
+        docs = []
+        for game_id in dirty:
+            try:
+                docs.append(_games[game_id].encode())
+            except Exception as e:
+                # Would fail on every flush; skip it, keep the rest of the batch
+                _metrics['failures'] += 1
+                logger.error(f"Game {game_id} cannot be encoded, not persisted: {e!r}")
+
+        started = time.perf_counter()
+        try:
+            await db.save_active_games(docs, list(deleted))
+        except Exception as e:
+            _metrics['failures'] += 1
+            logger.error(f"Game flush failed ({len(docs)} saves, {len(deleted)} deletes): {e!r}")
+            # Retry next time, unless the game changed state in the meantime
+            _dirty.update(g for g in dirty if g in _games and g not in _deleted)
+            _deleted.update(g for g in deleted if g not in _games)
+            return 0
+
+        elapsed = time.perf_counter() - started
+        _metrics['flushes'] += 1
+        _metrics['saved'] += len(docs)
+        _metrics['deleted'] += len(deleted)
+        _metrics['flush_max'] = max(_metrics['flush_max'], elapsed)
+        return len(docs) + len(deleted)
+
+async def _flush_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush()
+        except Exception as e:
+            # Keep flushing later batches whatever went wrong with this one
+            logger.error(f"Game flush crashed: {e!r}")
+
+def start(interval=None):
+    """Start the periodic flush task (call from a running event loop)"""
+    global _flusher
+    if _flusher is None:
+        interval = interval or config.GAME_FLUSH_INTERVAL
+        _flusher = asyncio.get_running_loop().create_task(_flush_loop(interval))
+
+async def stop():
+    """Stop the periodic flush and write whatever is still pending"""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await flush()
+
+def get_metrics():
+    """Live and pending counts, flush totals"""
+    return {
+        'live': len(_games),
+        'dirty': len(_dirty),
+        'pending_deletes': len(_deleted),
+        'flushes': _metrics['flushes'],
+        'saved': _metrics['saved'],
+        'deleted': _metrics['deleted'],
+        'failures': _metrics['failures'],
+        'flush_max_ms': _metrics['flush_max'] * 1000,
+    }
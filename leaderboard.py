@@ -0,0 +1,57 @@
+"""
+LEADERBOARD - Top players kept in memory
+
+Seeded from the database at startup and updated from every stats write.
+Points only ever go up, so a player can leave the top N only by being
+overtaken, and keeping just N entries stays exact.
+"""
+
+import config
+import database as db
+import utils
+
+_top = []     # Up to LEADERBOARD_SIZE player docs, highest points first
+_text = None  # Rendered leaderboard, None until the ranking changes
+
+def _ranking():
+    return [(p['user_id'], p.get('username'), p['points']) for p in _top]
+
+def _entry(player):
+    return {'user_id': player['user_id'], 'username': player.get('username'),
+            'points': player.get('points', 0)}
+
+async def seed():
+    """Load the current top players, returns how many"""
+    global _top, _text
+    players = await db.get_leaderboard(limit=config.LEADERBOARD_SIZE)
+    _top = [_entry(p) for p in players]
+    _text = None
+    return len(_top)
+
+def update(player):
+    """Apply a user doc with fresh points; re-renders only if the ranking moved"""
+    global _text
+    if not player:
+        return
+    before = _ranking()
+    entry = _entry(player)
+    for i, current in enumerate(_top):
+        if current['user_id'] == entry['user_id']:
+            _top[i] = entry
+            break
+    else:
+        if len(_top) >= config.LEADERBOARD_SIZE and entry['points'] <= _top[-1]['points']:
+            return
+        _top.append(entry)
+    # Stable sort: on equal points the earlier holder keeps the place
+    _top.sort(key=lambda p: -p['points'])
+    del _top[config.LEADERBOARD_SIZE:]
+    if _ranking() != before:
+        _text = None
+
+def get_text():
+    """Rendered leaderboard (cached)"""
+    global _text
+    if _text is None:
+        _text = utils.format_leaderboard(_top)
+    return _text
@@ -0,0 +1,48 @@
+"""
+LOCKS - Per-key async locks for concurrent update handling
+
+Updates are processed concurrently, so two of them touching the same game
+or challenge could interleave at an await (a surrender landing while the
+bot computes its reply, a timeout firing during a move). Handlers hold
+the key's lock around such read-modify-write sections; updates for other
+keys never wait. A key's lock exists only while someone holds or awaits it.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+_locks = {}  # key -> [asyncio.Lock, holders + waiters]
+
+# Lock metrics (read with get_metrics)
+_metrics = {
+    'acquired': 0,
+    'contended': 0,  # had to wait for another update
+}
+
+@asynccontextmanager
+async def hold(key):
+    """Serialize the block with every other holder of `key`"""
+    entry = _locks.get(key)
+    if entry is None:
+        entry = _locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        if entry[0].locked():
+            _metrics['contended'] += 1
+        async with entry[0]:
+            _metrics['acquired'] += 1
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _locks[key]
+
+def game(game_id):
+    return hold(('game', game_id))
+
+def challenge(challenge_id):
+    return hold(('challenge', challenge_id))
+
+def get_metrics():
+    """Acquisitions, how many waited, and keys currently locked"""
+    return {**_metrics, 'keys': len(_locks)}
@@ -0,0 +1,87 @@
+"""
+MEMBERSHIP - Cached forcesub channel membership checks
+
+Members are trusted for MEMBER_CACHE_TTL seconds and non-members for
+the shorter NONMEMBER_CACHE_TTL. Concurrent checks for the same user share
+one get_chat_member call. The join prompt's "I've joined" button drops a
+cached "no" (unless it is only seconds old), so joining takes effect
+immediately without every /start costing a lookup.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+import config
+import utils
+
+# (channel, user_id) -> (is_member, expires_at, checked_at), least recently used first
+_cache = OrderedDict()
+_inflight = {}     # (channel, user_id) -> task doing the lookup
+
+# Cache metrics (read with get_metrics)
+_metrics = {
+    'hits': 0,
+    'misses': 0,
+    'coalesced': 0,   # waited on a lookup already in flight
+    'lookups': 0,     # get_chat_member calls made
+    'invalidated': 0,
+}
+
+async def check(bot, user_id):
+    """True if user_id is in the forcesub channel (or none is set)"""
+    key = (config.FORCESUB_CHANNEL, user_id)
+    cached = _cache.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        _cache.move_to_end(key)
+        _metrics['hits'] += 1
+        return cached[0]
+
+    task = _inflight.get(key)
+    if task is not None:
+        _metrics['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    _metrics['misses'] += 1
+    task = asyncio.ensure_future(_lookup(bot, key))
+    _inflight[key] = task
+    return await asyncio.shield(task)
+
+async def _lookup(bot, key):
+    _metrics['lookups'] += 1
+    try:
+        is_member = await utils.check_membership(bot, key[1])
+    finally:
+        _inflight.pop(key, None)
+    ttl = config.MEMBER_CACHE_TTL if is_member else config.NONMEMBER_CACHE_TTL
+    now = time.monotonic()
+    _cache[key] = (is_member, now + ttl, now)
+    _cache.move_to_end(key)
+    while len(_cache) > config.MEMBERSHIP_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return is_member
+
+def recheck(user_id):
+    """User says they joined: forget a cached "no" older than the grace period
+
+    Returns True if the next check will ask Telegram again.
+    """
+    key = (config.FORCESUB_CHANNEL, user_id)
+    cached = _cache.get(key)
+    if cached is None:
+        return True
+    if cached[0] or time.monotonic() - cached[2] < config.MEMBERSHIP_RECHECK_GRACE:
+        return False
+    del _cache[key]
+    _metrics['invalidated'] += 1
+    return True
+
+def get_metrics():
+    """Size, hit rate, API calls made and saved"""
+    checks = _metrics['hits'] + _metrics['misses'] + _metrics['coalesced']
+    return {
+        **_metrics,
+        'size': len(_cache),
+        'capacity': config.MEMBERSHIP_CACHE_SIZE,
+        'hit_rate': (_metrics['hits'] + _metrics['coalesced']) / checks if checks else 0.0,
+    }
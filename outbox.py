@@ -0,0 +1,228 @@
+"""
+OUTBOX - Central scheduler for every outgoing Telegram request
+
+Plugged into the Application as its rate limiter, so every Bot API call
+(replies, edits, answers, broadcasts) passes through here. A request
+waits for a token from the global bucket and, for sends and edits, from
+its chat's bucket. Waiting requests are served by priority:
+interactive edits and callback answers first, then ordinary messages,
+then broadcasts and log posts (pass rate_limit_args=outbox.BULK). A 429
+pauses the offending chat (or everything, for chat-less calls) for
+retry_after and the request is retried.
+"""
+
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lower is served first
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+PRIORITY_NAMES = ['interactive', 'normal', 'bulk']
+
+# Default priority by endpoint when the caller does not pass one
+ENDPOINT_PRIORITY = {
+    'answerCallbackQuery': INTERACTIVE,
+    'editMessageText': INTERACTIVE,
+    'editMessageReplyMarkup': INTERACTIVE,
+}
+
+# Endpoints that count against the per-chat message limit
+_CHAT_LIMITED = ('send', 'edit', 'copy', 'forward')
+
+# Idle chat buckets are dropped once there are this many
+_MAX_CHAT_BUCKETS = 10000
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp', 'paused_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now):
+        """Seconds until a token is available (0 = now)"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+class Outbox(BaseRateLimiter):
+    """Token-bucket rate limiter with priorities and retry_after handling"""
+
+    __slots__ = ('_global', '_chats', '_queue', '_seq', '_wakeup', '_dispatcher', '_metrics')
+
+    def __init__(self):
+        self._global = TokenBucket(config.OUTBOX_GLOBAL_RATE, config.OUTBOX_GLOBAL_BURST)
+        self._chats = {}    # chat_id -> TokenBucket
+        self._queue = []    # [priority, seq, chat_id, future, enqueued_at], sorted
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._metrics = {
+            'granted': [0, 0, 0],
+            'wait_total': [0.0, 0.0, 0.0],
+            'wait_max': [0.0, 0.0, 0.0],
+            'retry_after': 0,
+            'peak_depth': 0,
+        }
+
+    # ============ LIFECYCLE ============
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for entry in self._queue:
+            if not entry[3].done():
+                entry[3].cancel()
+        self._queue.clear()
+
+    # ============ REQUESTS ============
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args is not None else ENDPOINT_PRIORITY.get(endpoint, NORMAL)
+        chat_id = data.get('chat_id') if endpoint.startswith(_CHAT_LIMITED) else None
+        for attempt in range(config.OUTBOX_MAX_RETRIES + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._metrics['retry_after'] += 1
+                if attempt == config.OUTBOX_MAX_RETRIES:
+                    raise
+                logger.warning(f"429 on {endpoint} (chat {chat_id}), pausing {e.retry_after}s")
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.paused_until = time.monotonic() + float(e.retry_after) + 0.1
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.idle(now)}
+            # Negative IDs are groups and channels, which have a lower limit
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(config.OUTBOX_CHAT_RATE, config.OUTBOX_CHAT_BURST)
+            else:
+                bucket = TokenBucket(config.OUTBOX_GROUP_RATE, config.OUTBOX_GROUP_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, priority):
+        """Wait for this request's turn"""
+        if self._dispatcher is None:
+            return  # Not initialized (scripts): no throttling
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._queue, [priority, next(self._seq), chat_id, future, time.monotonic()])
+        self._metrics['peak_depth'] = max(self._metrics['peak_depth'], len(self._queue))
+        self._wakeup.set()
+        await future
+
+    # ============ DISPATCH ============
+    async def _dispatch(self):
+        while True:
+            timeout = self._grant_next()
+            if timeout == 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_next(self):
+        """Release one request if possible: 0, else seconds to sleep (None = idle)"""
+        if not self._queue:
+            return None
+        now = time.monotonic()
+        global_delay = self._global.delay(now)
+        if global_delay:
+            return global_delay
+
+        soonest = None
+        blocked = set()
+        for index, (priority, _, chat_id, future, enqueued) in enumerate(self._queue):
+            if future.done():  # Caller gave up
+                del self._queue[index]
+                return 0
+            if chat_id in blocked:
+                continue  # Keep each chat's requests in order
+            delay = self._chat_bucket(chat_id).delay(now) if chat_id is not None else 0.0
+            if delay:
+                blocked.add(chat_id)
+                soonest = delay if soonest is None else min(soonest, delay)
+                continue
+
+            del self._queue[index]
+            self._global.take()
+            if chat_id is not None:
+                self._chats[chat_id].take()
+            waited = now - enqueued
+            self._metrics['granted'][priority] += 1
+            self._metrics['wait_total'][priority] += waited
+            self._metrics['wait_max'][priority] = max(self._metrics['wait_max'][priority], waited)
+            future.set_result(None)
+            return 0
+        return soonest
+
+    def get_metrics(self):
+        """Queue depth and wait times per priority (milliseconds)"""
+        depth = [0, 0, 0]
+        for entry in self._queue:
+            depth[entry[0]] += 1
+        m = self._metrics
+        return {
+            'depth': len(self._queue),
+            'peak_depth': m['peak_depth'],
+            'retry_after': m['retry_after'],
+            'paused_chats': sum(1 for b in self._chats.values() if b.paused_until > time.monotonic()),
+            'priorities': {
+                name: {
+                    'depth': depth[p],
+                    'granted': m['granted'][p],
+                    'wait_avg_ms': m['wait_total'][p] / m['granted'][p] * 1000 if m['granted'][p] else 0.0,
+                    'wait_max_ms': m['wait_max'][p] * 1000,
+                }
+                for p, name in enumerate(PRIORITY_NAMES)
+            },
+        }
+
+_limiter = None
+
+def get_limiter():
+    """Shared instance, passed to the Application builder"""
+    global _limiter
+    if _limiter is None:
+        _limiter = Outbox()
+    return _limiter
+
+def get_metrics():
+    return get_limiter().get_metrics()
@@ -0,0 +1,139 @@
+"""
+ROUTER - Table-driven callback query dispatch
+
+Callback data is "<action>" or "<action>_<arg>_<arg>...". Routes are
+registered per action and found with one dict lookup; their arguments
+are split off the right end (so the first may itself contain "_", as
+game IDs do) and converted to the declared types before the handler
+runs. Every route is timed separately.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = '_'
+
+class Call:
+    """One button press: the query plus an answer() that only answers once"""
+
+    __slots__ = ('update', 'context', 'query', 'user', 'answered')
+
+    def __init__(self, update, context):
+        self.update = update
+        self.context = context
+        self.query = update.callback_query
+        self.user = self.query.from_user
+        self.answered = False
+
+    async def answer(self, text=None, alert=False):
+        """Stop the button spinner, optionally with a toast or alert"""
+        if self.answered:
+            return
+        self.answered = True
+        if text is None:
+            await self.query.answer()
+        else:
+            await self.query.answer(text, show_alert=alert)
+
+class Route:
+    __slots__ = ('name', 'handler', 'types')
+
+    def __init__(self, name, handler, types):
+        self.name = name
+        self.handler = handler
+        self.types = types
+
+    def parse(self, rest):
+        """Typed arguments from the text after the action, or None if malformed"""
+        if not self.types:
+            return () if not rest else None
+        if not rest:
+            return None
+        parts = rest.rsplit(SEPARATOR, len(self.types) - 1)
+        try:
+            # Fewer parts than types: trailing handler defaults apply
+            return tuple(convert(part) for convert, part in zip(self.types, parts))
+        except ValueError:
+            return None
+
+class Router:
+    """Maps callback data to handlers: exact data first, then action prefix"""
+
+    def __init__(self):
+        self._exact = {}
+        self._actions = {}
+        self._metrics = {}
+
+    def route(self, action, *types, exact=False):
+        """Register `async handler(call, *args)` for an action
+
+        exact=True matches the whole callback data (e.g. "play_again");
+        otherwise data "action_a_b" calls handler(call, types[0](a), types[1](b)).
+        """
+        def register(handler):
+            table = self._exact if exact else self._actions
+            table[action] = Route(action, handler, types)
+            self._metrics[action] = {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0}
+            return handler
+        return register
+
+    def resolve(self, data):
+        """(route, args), or (None, None) for unknown or malformed data"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ()
+        action, _, rest = data.partition(SEPARATOR)
+        route = self._actions.get(action)
+        if route is None:
+            return None, None
+        args = route.parse(rest)
+        return (route, args) if args is not None else (None, None)
+
+    async def dispatch(self, update, context):
+        """Run the handler for a callback query update"""
+        call = Call(update, context)
+        route, args = self.resolve(call.query.data or '')
+        if route is None:
+            logger.warning(f"Unhandled callback data {call.query.data!r}")
+            await call.answer("This button is no longer available.")
+            return
+
+        metrics = self._metrics[route.name]
+        started = time.perf_counter()
+        try:
+            await route.handler(call, *args)
+        except Exception:
+            metrics['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics['calls'] += 1
+            metrics['total'] += elapsed
+            metrics['max'] = max(metrics['max'], elapsed)
+            # Handlers that did not answer (or failed) still stop the spinner
+            if not call.answered:
+                try:
+                    await call.answer()
+                except Exception as e:
+                    logger.debug(f"Late answer failed: {e!r}")
+
+    def get_metrics(self):
+        """Per-route calls, errors and timing (milliseconds), slowest average first"""
+        rows = {
+            name: {
+                'calls': m['calls'],
+                'errors': m['errors'],
+                'avg_ms': m['total'] / m['calls'] * 1000 if m['calls'] else 0.0,
+                'max_ms': m['max'] * 1000,
+            }
+            for name, m in self._metrics.items()
+        }
+        return dict(sorted(rows.items(), key=lambda item: -item[1]['avg_ms']))
+
+# Shared router: bot.py registers the routes, admin reads the metrics
+_router = Router()
+route = _router.route
+dispatch = _router.dispatch
+get_metrics = _router.get_metrics
@@ -0,0 +1,96 @@
+"""
+RULES - Board variants and win-line generation
+"""
+
+# Telegram inline keyboard limits
+MAX_KEYBOARD_COLUMNS = 8
+MAX_KEYBOARD_BUTTONS = 100
+
+# Variant name -> (board size, marks in a row needed to win)
+VARIANTS = {
+    '3x3': (3, 3),
+    '4x4': (4, 4),
+    '5x5': (5, 4),
+    'ultimate': (9, 3),  # Nine 3x3 boards, rules live in ultimate.py
+}
+
+DEFAULT_VARIANT = '3x3'
+
+def win_lines(size, k):
+    """Every run of k cells in a row on a size x size board
+
+    Ordered horizontal, vertical, diagonal, anti-diagonal, so 3x3 matches
+    the classic WIN_COMBINATIONS order.
+    """
+    lines = []
+    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
+    for dr, dc in directions:
+        for r in range(size):
+            for c in range(size):
+                end_r = r + dr * (k - 1)
+                end_c = c + dc * (k - 1)
+                if 0 <= end_r < size and 0 <= end_c < size:
+                    lines.append([(r + dr * i) * size + c + dc * i for i in range(k)])
+    return lines
+
+class Rules:
+    """Geometry and win lines of one variant, as bitboard masks"""
+
+    def __init__(self, name, size, k):
+        if size > MAX_KEYBOARD_COLUMNS or size * size + 1 > MAX_KEYBOARD_BUTTONS:
+            raise ValueError(f"{name} board does not fit a Telegram inline keyboard")
+        self.name = name
+        self.size = size
+        self.k = k
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        self.win_lines = win_lines(size, k)
+        self.win_masks = [sum(1 << i for i in line) for line in self.win_lines]
+        # Indexes of the lines through each cell
+        self.cell_lines = [[index for index, line in enumerate(self.win_lines) if cell in line]
+                           for cell in range(self.cells)]
+        # (mask, line) pairs through each cell, for checking only the last move
+        self.cell_line_masks = [[(self.win_masks[i], self.win_lines[i]) for i in indexes]
+                                for indexes in self.cell_lines]
+        # Small boards: first line contained in every possible side mask
+        self.line_table = None
+        if self.cells <= 12:
+            self.line_table = [self._scan(mask) for mask in range(1 << self.cells)]
+
+    def _scan(self, mask):
+        for index, line in enumerate(self.win_masks):
+            if mask & line == line:
+                return index
+        return -1
+
+    def find_line(self, mask):
+        """Index of a win line fully owned by mask, or -1"""
+        if self.line_table is not None:
+            return self.line_table[mask]
+        return self._scan(mask)
+
+    def line_through(self, mask, cell):
+        """Win line through cell fully owned by mask, or None"""
+        for line_mask, line in self.cell_line_masks[cell]:
+            if mask & line_mask == line_mask:
+                return line
+        return None
+
+    def empty_cells(self, x_mask, o_mask):
+        """Positions not taken by either side"""
+        free = self.full_mask & ~(x_mask | o_mask)
+        return [i for i in range(self.cells) if free >> i & 1]
+
+_rules = {}
+
+def get_rules(variant=DEFAULT_VARIANT):
+    """Rules for a variant name (built once)"""
+    rules = _rules.get(variant)
+    if rules is None:
+        if variant == 'ultimate':
+            import ultimate  # Imports this module, so load it lazily
+            rules = _rules[variant] = ultimate.RULES
+        else:
+            size, k = VARIANTS[variant]
+            rules = _rules[variant] = Rules(variant, size, k)
+    return rules
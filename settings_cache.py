@@ -0,0 +1,79 @@
+"""
+SETTINGS CACHE - Bot settings in memory, kept in sync across processes
+
+The settings document is loaded once at startup and every read is served
+from memory. Each update bumps a version number stored with the
+settings; every process polls just that number every
+SETTINGS_POLL_INTERVAL seconds and reloads when it moves, so all dynos
+converge without a database read per request.
+"""
+
+import asyncio
+import logging
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Settings mirrored onto config attributes, which the handlers read
+CONFIG_ATTRS = {
+    'forcesub_enabled': 'FORCESUB_ENABLED',
+    'forcesub_channel': 'FORCESUB_CHANNEL',
+}
+_DEFAULTS = {key: getattr(config, attr) for key, attr in CONFIG_ATTRS.items()}
+
+_settings = {}
+_version = None
+_poller = None
+
+def _apply(doc):
+    global _settings, _version
+    doc = dict(doc or {})
+    doc.pop('_id', None)
+    _version = doc.pop('version', 0)
+    _settings = doc
+    for key, attr in CONFIG_ATTRS.items():
+        setattr(config, attr, doc.get(key, _DEFAULTS[key]))
+
+def get(key, default=None):
+    """Current value of a setting (memory read)"""
+    return _settings.get(key, default)
+
+def get_version():
+    return _version
+
+async def load():
+    """(Re)load every setting from the database"""
+    _apply(await db.get_settings())
+    logger.info(f"Settings loaded (version {_version})")
+
+async def update(**values):
+    """Write settings; applied here at once, elsewhere on the next poll"""
+    _apply(await db.update_settings(values))
+
+async def _poll_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await db.get_settings_version() != _version:
+                await load()
+        except Exception as e:
+            logger.warning(f"Settings poll failed: {e!r}")
+
+def start():
+    """Start polling for changes made by other processes"""
+    global _poller
+    if _poller is None:
+        interval = config.SETTINGS_POLL_INTERVAL
+        _poller = asyncio.get_running_loop().create_task(_poll_loop(interval))
+
+async def stop():
+    global _poller
+    if _poller is not None:
+        _poller.cancel()
+        try:
+            await _poller
+        except asyncio.CancelledError:
+            pass
+        _poller = None
@@ -0,0 +1,178 @@
+"""
+STATS WRITER - Buffered stats and history writes
+
+Finished games are queued here instead of each doing its own update.
+Results are merged per user and written with one bulk_write (plus one
+insert_many for history) every STATS_FLUSH_MS, or sooner once
+STATS_FLUSH_OPS results are waiting. When STATS_QUEUE_MAX results are
+pending, record() waits for a flush instead of growing the queue.
+"""
+
+import asyncio
+import logging
+import time
+
+from pymongo.errors import BulkWriteError
+
+import config
+import database as db
+
+logger = logging.getLogger(__name__)
+
+_results = {}   # user_id -> results in arrival order
+_waiters = {}   # user_id -> futures waiting for the updated user
+_history = []   # game_history docs
+_pending = 0    # results queued since the last flush
+_flusher = None
+_flush_lock = asyncio.Lock()
+_has_space = asyncio.Event()
+_has_space.set()
+_full = asyncio.Event()
+
+# Writer metrics (read with get_metrics)
+_metrics = {
+    'ops': 0,          # results and history docs written
+    'round_trips': 0,  # database calls used for them
+    'flushes': 0,
+    'failures': 0,
+    'backpressure_waits': 0,
+}
+
+async def record(user_id, result, history=None):
+    """Queue a game result, returns the updated user once it is written
+
+    Returns None if the user does not exist or the write failed. Before
+    start() (scripts, tests) the result is written straight through.
+    """
+    global _pending
+    if _flusher is None:
+        if history is not None:
+            await db.save_game_history(history)
+        return await db.update_user_stats(user_id, result)
+
+    while _pending >= config.STATS_QUEUE_MAX:
+        _metrics['backpressure_waits'] += 1
+        _full.set()
+        _has_space.clear()
+        await _has_space.wait()
+
+    future = asyncio.get_running_loop().create_future()
+    _results.setdefault(user_id, []).append(result)
+    _waiters.setdefault(user_id, []).append(future)
+    if history is not None:
+        _history.append(history)
+    _pending += 1
+    if _pending >= config.STATS_FLUSH_OPS:
+        _full.set()
+    return await future
+
+async def flush():
+    """Write everything queued so far, returns the number of results written"""
+    global _results, _waiters, _history, _pending
+    async with _flush_lock:
+        if not _results and not _history:
+            return 0
+        results, waiters, history = _results, _waiters, _history
+        _results, _waiters, _history, _pending = {}, {}, [], 0
+        _full.clear()
+        _has_space.set()
+
+        ops = sum(len(r) for r in results.values()) + len(history)
+        round_trips = bool(results) + bool(history) + bool(waiters)
+        started = time.perf_counter()
+        # Separate calls: only a failed (or unknown) stats write is retried,
+        # since requeueing applied $inc updates would count them twice
+        requeued = set()
+        try:
+            if results:
+                await db.apply_stats_batch(results)
+        except BulkWriteError as e:
+            # Unordered: everything but the reported updates went through
+            _metrics['failures'] += 1
+            failed = {e_['index'] for e_ in e.details.get('writeErrors', [])}
+            logger.error(f"Stats flush: {len(failed)} of {len(results)} user updates failed")
+            for index, user_id in enumerate(results):
+                if index in failed:
+                    _requeue(user_id, results[user_id])
+                    requeued.add(user_id)
+        except Exception as e:
+            # Unknown outcome: retry the stats
+            _metrics['failures'] += 1
+            logger.error(f"Stats flush failed, {len(results)} users requeued: {e!r}")
+            for user_id, user_results in results.items():
+                _requeue(user_id, user_results)
+            requeued.update(results)
+
+        # History is best effort
+        try:
+            if history:
+                await db.save_game_history_batch(history)
+        except Exception as e:
+            _metrics['failures'] += 1
+            logger.error(f"History flush failed, {len(history)} games not saved: {e!r}")
+
+        # Callers of requeued results get None, as for any failed write
+        updated = {}
+        refresh = [user_id for user_id in waiters if user_id not in requeued]
+        try:
+            if refresh:
+                updated = await db.get_users(refresh)
+        except Exception as e:
+            logger.warning(f"Stats refresh failed: {e!r}")
+
+        for user_id, futures in waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(updated.get(user_id))
+
+        _metrics['ops'] += ops
+        _metrics['round_trips'] += round_trips
+        _metrics['flushes'] += 1
+        logger.info(f"Stats flush: {ops} writes in {round_trips} round trips "
+                    f"({ops - round_trips} saved) in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return ops
+
+def _requeue(user_id, results):
+    """Put results back in front of anything queued since the flush began"""
+    global _pending
+    _results[user_id] = results + _results.get(user_id, [])
+    _pending += len(results)
+
+async def _flush_loop(interval):
+    while True:
+        try:
+            await asyncio.wait_for(_full.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        await flush()
+
+def start():
+    """Start the background flush task (call from a running event loop)"""
+    global _flusher
+    if _flusher is None:
+        interval = config.STATS_FLUSH_MS / 1000
+        _flusher = asyncio.get_running_loop().create_task(_flush_loop(interval))
+
+async def stop():
+    """Stop the flush task and write whatever is still queued"""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+    await flush()
+
+def get_metrics():
+    """Queue depth and write totals"""
+    return {
+        'pending': _pending,
+        'flushes': _metrics['flushes'],
+        'ops': _metrics['ops'],
+        'round_trips': _metrics['round_trips'],
+        'writes_saved': _metrics['ops'] - _metrics['round_trips'],
+        'failures': _metrics['failures'],
+        'backpressure_waits': _metrics['backpressure_waits'],
+    }
@@ -0,0 +1,131 @@
+"""
+TIMERS - One scheduler for every move and challenge deadline
+
+Deadlines live in a heap ordered by wall-clock time (epoch seconds, so
+they survive a restart when persisted). Rescheduling a key pushes a new
+entry and leaves the old one to be skipped when it surfaces, which keeps
+every operation O(log n) for hundreds of thousands of timers; the heap is
+rebuilt once skipped entries outnumber live ones. A single task sleeps
+until the earliest deadline and runs due callbacks as their own tasks.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_heap = []        # (deadline, seq, key)
+_live = {}        # key -> (deadline, seq, callback)
+_seq = itertools.count()
+_runner = None
+_wakeup = None    # Set when a deadline earlier than the one being slept on arrives
+_sleeping_until = float('inf')
+_firing = set()   # Callback tasks still running (the loop only holds them weakly)
+
+# Timer metrics (read with get_metrics)
+_metrics = {
+    'scheduled': 0,
+    'cancelled': 0,
+    'fired': 0,
+    'failed': 0,
+    'compactions': 0,
+}
+
+def schedule(key, deadline, callback):
+    """Run `await callback()` at deadline (epoch seconds), replacing key's timer"""
+    seq = next(_seq)
+    _live[key] = (deadline, seq, callback)
+    heapq.heappush(_heap, (deadline, seq, key))
+    _metrics['scheduled'] += 1
+    if deadline < _sleeping_until and _wakeup is not None:
+        _wakeup.set()
+    if len(_heap) > 2 * len(_live) + 1024:
+        _compact()
+
+def cancel(key):
+    """Drop key's timer, if any"""
+    if _live.pop(key, None) is not None:
+        _metrics['cancelled'] += 1
+
+def deadline_of(key):
+    """Pending deadline for key, or None"""
+    entry = _live.get(key)
+    return entry[0] if entry else None
+
+def _compact():
+    global _heap
+    _heap = [(deadline, seq, key) for key, (deadline, seq, _) in _live.items()]
+    heapq.heapify(_heap)
+    _metrics['compactions'] += 1
+
+def _pop_due(now):
+    """Callbacks whose deadline has passed, removing them"""
+    due = []
+    while _heap and _heap[0][0] <= now:
+        deadline, seq, key = heapq.heappop(_heap)
+        entry = _live.get(key)
+        if entry is None or entry[1] != seq:
+            continue  # Cancelled or rescheduled
+        del _live[key]
+        due.append((key, entry[2]))
+    return due
+
+async def _fire(key, callback):
+    try:
+        await callback()
+        _metrics['fired'] += 1
+    except Exception as e:
+        _metrics['failed'] += 1
+        logger.error(f"Timer {key!r} failed: {e!r}")
+
+async def _run():
+    global _sleeping_until
+    while True:
+        for key, callback in _pop_due(time.time()):
+            task = asyncio.ensure_future(_fire(key, callback))
+            _firing.add(task)
+            task.add_done_callback(_firing.discard)
+        # Skip stale heads so the sleep targets a live deadline
+        while _heap and _live.get(_heap[0][2], (None, None))[1] != _heap[0][1]:
+            heapq.heappop(_heap)
+        _sleeping_until = _heap[0][0] if _heap else float('inf')
+        _wakeup.clear()
+        timeout = None if not _heap else max(_sleeping_until - time.time(), 0)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def start():
+    """Start the scheduler task (call from a running event loop)"""
+    global _runner, _wakeup
+    if _runner is None:
+        _wakeup = asyncio.Event()
+        _runner = asyncio.get_running_loop().create_task(_run())
+
+async def stop():
+    """Stop firing; pending deadlines stay persisted with their games"""
+    global _runner, _wakeup, _sleeping_until
+    if _runner is not None:
+        _runner.cancel()
+        try:
+            await _runner
+        except asyncio.CancelledError:
+            pass
+        _runner = _wakeup = None
+        _sleeping_until = float('inf')
+    # Let timeouts already firing finish (their games are flushed after this)
+    if _firing:
+        await asyncio.gather(*_firing, return_exceptions=True)
+
+def get_metrics():
+    """Pending timers and totals"""
+    return {
+        **_metrics,
+        'pending': len(_live),
+        'running': len(_firing),
+        'heap': len(_heap),
+    }
@@ -0,0 +1,336 @@
+"""
+ULTIMATE TIC TAC TOE - Nine sub-boards, Monte Carlo tree search bot
+
+Cells are numbered board-major: cell = board * 9 + position, where both
+board and position use the classic 0-8 layout. The position you play in
+picks the board your opponent must play in next; if that board is
+already won or full they may play in any open board. Win three boards in
+a row to win the game.
+"""
+
+import math
+import random
+import time
+from collections import OrderedDict
+
+import rules
+
+CLASSIC = rules.get_rules('3x3')
+SUB_FULL = CLASSIC.full_mask
+_LINE = CLASSIC.line_table
+
+# Playouts per bot move by difficulty: CPU cost per move scales linearly
+PLAYOUTS = {'easy': 50, 'medium': 300, 'hard': 1000, 'impossible': 4000}
+
+# Live search trees kept for reuse between turns
+MAX_TREES = 500
+
+class UltimateRules:
+    """Geometry of the ultimate variant (same attributes GameSession relies on)"""
+
+    name = 'ultimate'
+    size = 9
+    k = 3
+    cells = 81
+    full_mask = (1 << 81) - 1
+
+RULES = UltimateRules()
+
+# ============ STATE ============
+class State:
+    """Array-backed position for fast playouts"""
+
+    __slots__ = ('xs', 'os', 'closed', 'macro_x', 'macro_o', 'forced', 'turn', 'winner')
+
+    def __init__(self):
+        self.xs = [0] * 9
+        self.os = [0] * 9
+        self.closed = 0     # Boards won or full
+        self.macro_x = 0    # Boards won by X
+        self.macro_o = 0    # Boards won by O
+        self.forced = -1    # Board the side to move must play in, -1 = any
+        self.turn = 1       # 1 = X, 2 = O
+        self.winner = 0     # 0 = ongoing, 1/2 = winner, 3 = draw
+
+    @classmethod
+    def from_bits(cls, bits, last=-1):
+        """State from packed session bits (x | o << 81) and the last move"""
+        state = cls()
+        x_mask = bits & RULES.full_mask
+        o_mask = bits >> RULES.cells
+        for board in range(9):
+            x_sub = x_mask >> board * 9 & SUB_FULL
+            o_sub = o_mask >> board * 9 & SUB_FULL
+            state.xs[board] = x_sub
+            state.os[board] = o_sub
+            if _LINE[x_sub] >= 0:
+                state.macro_x |= 1 << board
+                state.closed |= 1 << board
+            elif _LINE[o_sub] >= 0:
+                state.macro_o |= 1 << board
+                state.closed |= 1 << board
+            elif x_sub | o_sub == SUB_FULL:
+                state.closed |= 1 << board
+        state.turn = 1 if x_mask.bit_count() == o_mask.bit_count() else 2
+        if last >= 0 and not state.closed >> last % 9 & 1:
+            state.forced = last % 9
+        if _LINE[state.macro_x] >= 0:
+            state.winner = 1
+        elif _LINE[state.macro_o] >= 0:
+            state.winner = 2
+        elif state.closed == SUB_FULL:
+            state.winner = 3
+        return state
+
+    def copy(self):
+        state = State.__new__(State)
+        state.xs = self.xs[:]
+        state.os = self.os[:]
+        state.closed = self.closed
+        state.macro_x = self.macro_x
+        state.macro_o = self.macro_o
+        state.forced = self.forced
+        state.turn = self.turn
+        state.winner = self.winner
+        return state
+
+    def open_boards(self):
+        if self.forced >= 0:
+            return [self.forced]
+        return [b for b in range(9) if not self.closed >> b & 1]
+
+    def legal_moves(self):
+        if self.winner:
+            return []
+        moves = []
+        for board in self.open_boards():
+            free = SUB_FULL & ~(self.xs[board] | self.os[board])
+            while free:
+                low = free & -free
+                moves.append(board * 9 + low.bit_length() - 1)
+                free ^= low
+        return moves
+
+    def play(self, move):
+        """Apply a legal move; returns the winning macro line index or -1"""
+        board, position = divmod(move, 9)
+        bit = 1 << board
+        line = -1
+        if self.turn == 1:
+            sub = self.xs[board] = self.xs[board] | 1 << position
+            if _LINE[sub] >= 0:
+                self.closed |= bit
+                self.macro_x |= bit
+                line = _LINE[self.macro_x]
+                if line >= 0:
+                    self.winner = 1
+            elif sub | self.os[board] == SUB_FULL:
+                self.closed |= bit
+        else:
+            sub = self.os[board] = self.os[board] | 1 << position
+            if _LINE[sub] >= 0:
+                self.closed |= bit
+                self.macro_o |= bit
+                line = _LINE[self.macro_o]
+                if line >= 0:
+                    self.winner = 2
+            elif sub | self.xs[board] == SUB_FULL:
+                self.closed |= bit
+
+        if not self.winner and self.closed == SUB_FULL:
+            self.winner = 3
+        self.forced = -1 if self.closed >> position & 1 else position
+        self.turn = 3 - self.turn
+        return line
+
+    def rollout(self, rng):
+        """Play uniformly random moves to the end, return the winner (3 = draw)"""
+        xs, os = self.xs, self.os
+        while not self.winner:
+            board = self.forced
+            if board < 0:
+                open_boards = [b for b in range(9) if not self.closed >> b & 1]
+                board = open_boards[int(rng() * len(open_boards))]
+            free = SUB_FULL & ~(xs[board] | os[board])
+            count = free.bit_count()
+            pick = int(rng() * count)
+            while pick:
+                free &= free - 1
+                pick -= 1
+            position = (free & -free).bit_length() - 1
+            self.play(board * 9 + position)
+        return self.winner
+
+# ============ MONTE CARLO TREE SEARCH ============
+class Node:
+    """Search tree node; wins are counted for the side that played `move`"""
+
+    __slots__ = ('move', 'parent', 'children', 'untried', 'wins', 'visits', 'mover')
+
+    def __init__(self, move, parent, untried, mover):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.wins = 0.0
+        self.visits = 0
+        self.mover = mover
+
+    def select(self, exploration=1.4):
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda c: c.wins / c.visits
+                   + exploration * math.sqrt(log_visits / c.visits))
+
+def search(state, playouts, max_time=None, root=None, rng=None):
+    """MCTS from state: (best move, root, stats)
+
+    Runs `playouts` iterations (or fewer if max_time runs out). Pass the
+    matching subtree from a previous search as `root` to reuse it.
+    """
+    rng = rng or random.random
+    if root is None:
+        root = Node(None, None, state.legal_moves(), 3 - state.turn)
+    reused = root.visits
+    started = time.perf_counter()
+    deadline = started + max_time if max_time is not None else None
+
+    done = 0
+    for done in range(1, playouts + 1):
+        node = root
+        current = state.copy()
+
+        # Select
+        while not node.untried and node.children:
+            node = node.select()
+            current.play(node.move)
+
+        # Expand
+        if node.untried:
+            move = node.untried.pop(int(rng() * len(node.untried)))
+            mover = current.turn
+            current.play(move)
+            child = Node(move, node, current.legal_moves(), mover)
+            node.children.append(child)
+            node = child
+
+        # Simulate
+        winner = current.rollout(rng) if not current.winner else current.winner
+
+        # Backpropagate
+        while node is not None:
+            node.visits += 1
+            if winner == node.mover:
+                node.wins += 1.0
+            elif winner == 3:
+                node.wins += 0.5
+            node = node.parent
+
+        if deadline is not None and not done % 64 and time.perf_counter() > deadline:
+            break
+
+    best = max(root.children, key=lambda c: c.visits)
+    elapsed = time.perf_counter() - started
+    stats = {
+        'playouts': done,
+        'reused': reused,
+        'win_rate': best.wins / best.visits,
+        'elapsed': elapsed,
+        'pps': done / elapsed if elapsed else 0.0,
+    }
+    return best.move, root, stats
+
+# ============ TREE REUSE ============
+# game_id -> (root, move chosen from it, board bits once that move is played)
+# A search that ran past its budget still stores its tree although its move
+# was not played, so reuse checks the exact position, not just the move count
+_trees = OrderedDict()
+
+def _reuse_tree(game_id, bits, last):
+    """Subtree for the current position if the last search's tree covers it"""
+    cached = _trees.pop(game_id, None)
+    if cached is None:
+        return None
+    root, chosen, chosen_bits = cached
+    # Current position = the chosen move's position plus one reply at `last`
+    if last is None or bits & chosen_bits != chosen_bits or bits ^ chosen_bits not in (
+            1 << last, 1 << last << RULES.cells):
+        return None
+    child = next((c for c in root.children if c.move == chosen), None)
+    if child is None:
+        return None
+    grandchild = next((c for c in child.children if c.move == last), None)
+    if grandchild is not None:
+        grandchild.parent = None
+    return grandchild
+
+def release_tree(game_id):
+    """Drop a finished game's tree"""
+    _trees.pop(game_id, None)
+
+# ============ SESSION API ============
+def make_move(game_session, position, player_id):
+    """Ultimate counterpart of game.make_move (same result shape)"""
+    state = State.from_bits(game_session.bits, game_session.last)
+    if state.winner or not 0 <= position < RULES.cells:
+        return {'valid': False, 'message': 'Invalid move!'}
+    symbol = 1 if player_id == game_session.player1 else 2
+    if symbol != state.turn:
+        return {'valid': False, 'message': 'Not your turn!'}
+    board, cell = divmod(position, 9)
+    if state.closed >> board & 1 or (state.forced >= 0 and board != state.forced):
+        return {'valid': False, 'message': 'Play in the highlighted board!'}
+    if (state.xs[board] | state.os[board]) >> cell & 1:
+        return {'valid': False, 'message': 'Position occupied!'}
+
+    line = state.play(position)
+    shift = 0 if symbol == 1 else RULES.cells
+    game_session.bits |= 1 << position << shift
+    game_session.last = position
+
+    if state.winner in (1, 2):
+        winner = game_session.player1 if state.winner == 1 else game_session.player2
+        return {'valid': True, 'status': 'finished', 'winner': winner,
+                'combo': CLASSIC.win_lines[line]}
+    if state.winner == 3:
+        return {'valid': True, 'status': 'finished', 'winner': 'draw'}
+    return {'valid': True, 'status': 'ongoing', 'winner': None}
+
+def check_game_status(game_session):
+    """Ultimate counterpart of game.check_game_status"""
+    state = State.from_bits(game_session.bits, game_session.last)
+    if state.winner in (1, 2):
+        macro = state.macro_x if state.winner == 1 else state.macro_o
+        winner = game_session.player1 if state.winner == 1 else game_session.player2
+        return {'status': 'finished', 'winner': winner,
+                'combo': CLASSIC.win_lines[_LINE[macro]]}
+    if state.winner == 3:
+        return {'status': 'finished', 'winner': 'draw'}
+    return {'status': 'ongoing'}
+
+def get_bot_move(game_session, max_time=None):
+    """MCTS move, playout count set by difficulty"""
+    state = State.from_bits(game_session.bits, game_session.last)
+    playouts = PLAYOUTS.get(game_session.difficulty, PLAYOUTS['impossible'])
+    root = _reuse_tree(game_session.game_id, game_session.bits, game_session.last)
+    move, root, _ = search(state, playouts, max_time=max_time, root=root)
+
+    shift = 0 if state.turn == 1 else RULES.cells
+    _trees[game_session.game_id] = (root, move, game_session.bits | 1 << move << shift)
+    while len(_trees) > MAX_TREES:
+        _trees.popitem(last=False)
+    return move
+
+def quick_move(game_session):
+    """Cheap move: take a sub-board if possible, else random legal"""
+    state = State.from_bits(game_session.bits, game_session.last)
+    moves = state.legal_moves()
+    own = state.xs if state.turn == 1 else state.os
+    for move in moves:
+        board, cell = divmod(move, 9)
+        if _LINE[own[board] | 1 << cell] >= 0:
+            return move
+    return random.choice(moves)
+
+def get_state(game_session):
+    """Decoded position, for rendering"""
+    return State.from_bits(game_session.bits, game_session.last)
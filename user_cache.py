@@ -0,0 +1,63 @@
+"""
+USER CACHE - Recently seen users, so /start skips redundant upserts
+"""
+
+import time
+from collections import OrderedDict
+
+import config
+import database as db
+
+# user_id -> (username, first_name, written_at), least recently seen first
+_users = OrderedDict()
+
+# Cache metrics (read with get_metrics)
+_metrics = {
+    'hits': 0,      # upsert skipped
+    'new': 0,       # not cached (first visit or evicted)
+    'changed': 0,   # username or first name differs
+    'stale': 0,     # last_active older than USER_ACTIVE_GRANULARITY
+}
+
+async def touch(user_id, username, first_name):
+    """Record a visit; writes only if the profile changed or last_active is stale
+
+    Returns True if add_user was issued.
+    """
+    now = time.monotonic()
+    cached = _users.get(user_id)
+    if cached is None:
+        reason = 'new'
+    elif cached[:2] != (username, first_name):
+        reason = 'changed'
+    elif now - cached[2] >= config.USER_ACTIVE_GRANULARITY:
+        reason = 'stale'
+    else:
+        _users.move_to_end(user_id)
+        _metrics['hits'] += 1
+        return False
+
+    _metrics[reason] += 1
+    await db.add_user(user_id, username, first_name)
+    _users[user_id] = (username, first_name, now)
+    _users.move_to_end(user_id)
+    while len(_users) > config.USER_CACHE_SIZE:
+        _users.popitem(last=False)
+    return True
+
+def forget(user_ids):
+    """Drop users whose record changed elsewhere, so their next visit writes"""
+    for user_id in user_ids:
+        _users.pop(user_id, None)
+
+def get_metrics():
+    """Size, hits and misses by reason"""
+    misses = _metrics['new'] + _metrics['changed'] + _metrics['stale']
+    lookups = _metrics['hits'] + misses
+    return {
+        **_metrics,
+        'size': len(_users),
+        'capacity': config.USER_CACHE_SIZE,
+        'misses': misses,
+        'hit_rate': _metrics['hits'] / lookups if lookups else 0.0,
+    }
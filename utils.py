@@ -2,11 +2,22 @@
 UTILITIES - Messages, keyboards, helpers
 """
 
+import asyncio
+import logging
 import random
 import string
 from datetime import datetime
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import config
+import outbox
+import rules
+import ultimate
+
+logger = logging.getLogger(__name__)
+
+# Log posts waiting in the outbox; beyond this many new ones are dropped
+MAX_PENDING_LOGS = 1000
+_log_tasks = set()  # The loop only holds tasks weakly
 
 # ============ MESSAGES ============
 WELCOME_MESSAGE = """
@@ -19,6 +30,14 @@ Welcome {name}!
 Select an option:
 """
 
+BOARD_MESSAGE = """
+━━━━━━━━━━━━━━━━━━━━━━
+ SELECT BOARD
+━━━━━━━━━━━━━━━━━━━━━━
+
+Choose your board size:
+"""
+
 DIFFICULTY_MESSAGE = """
 ━━━━━━━━━━━━━━━━━━━━━━
  SELECT DIFFICULTY
@@ -27,6 +46,42 @@ DIFFICULTY_MESSAGE = """
 Choose your opponent:
 """
 
+TIMEOUT_MESSAGE = f"""
+
+⏰ TIME'S UP! No move in {config.MOVE_TIMEOUT}s, game forfeited."""
+
+CHALLENGE_EXPIRED_MESSAGE = """━━━━━━━━━━━━━━━━━━━━━━
+ TIC TAC TOE • ARENA
+━━━━━━━━━━━━━━━━━━━━━━
+
+⌛ Challenge expired
+
+Nobody accepted in time.
+Send /challenge to try again!
+━━━━━━━━━━━━━━━━━━━━━━"""
+
+CHALLENGE_CANCELLED_MESSAGE = """━━━━━━━━━━━━━━━━━━━━━━
+ TIC TAC TOE • ARENA
+━━━━━━━━━━━━━━━━━━━━━━
+
+❌ Challenge cancelled
+
+Send /challenge to start a new one!
+━━━━━━━━━━━━━━━━━━━━━━"""
+
+SURRENDER_MESSAGE = f"""
+
+🏳️ SURRENDERED! +{config.POINTS_LOSS} Points"""
+
+CHALLENGE_HINT_MESSAGE = """
+━━━━━━━━━━━━━━━━━━━━━━
+ CHALLENGE A FRIEND
+━━━━━━━━━━━━━━━━━━━━━━
+
+Add me to a group and send /challenge there.
+Anyone in the group can accept!
+"""
+
 FORCESUB_MESSAGE = """
 ━━━━━━━━━━━━━━━━━━━━━━
  TIC TAC TOE • ARENA
@@ -37,7 +92,7 @@ FORCESUB_MESSAGE = """
 To use this bot, you must
 join our channel first!
 
-After joining, click /start
+After joining, tap ✅ I've Joined
 """
 
 HELP_MESSAGE = """
@@ -54,6 +109,10 @@ HELP_MESSAGE = """
 📋 Rules:
 Get 3 in a row to win!
 Horizontal, Vertical or Diagonal
+4x4: 4 in a row • 5x5: 4 in a row
+Ultimate: your cell picks the
+opponent's next board. Win 3
+boards in a row!
 
 💰 Points:
 Win: +25 points
@@ -74,26 +133,40 @@ def get_main_menu_keyboard():
         [InlineKeyboardButton("❓ Help", callback_data="help")]
     ])
 
-def get_difficulty_keyboard():
-    """Difficulty selection buttons"""
+def get_board_size_keyboard():
+    """Board variant selection buttons"""
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🟢 Easy", callback_data="difficulty_easy")],
-        [InlineKeyboardButton("🟡 Medium", callback_data="difficulty_medium")],
-        [InlineKeyboardButton("🔴 Hard", callback_data="difficulty_hard")],
-        [InlineKeyboardButton("💀 Impossible", callback_data="difficulty_impossible")],
+        [InlineKeyboardButton("3️⃣ Classic 3x3", callback_data="board_3x3")],
+        [InlineKeyboardButton("4️⃣ 4x4 • 4 in a row", callback_data="board_4x4")],
+        [InlineKeyboardButton("5️⃣ 5x5 • 4 in a row", callback_data="board_5x5")],
+        [InlineKeyboardButton("🌌 Ultimate • 9 boards", callback_data="board_ultimate")],
         [InlineKeyboardButton("◀️ Back", callback_data="menu")]
     ])
 
-def get_game_keyboard(game_session):
-    """Generate game board keyboard"""
-    board = game_session['board']
-    game_id = game_session['game_id']
+def get_difficulty_keyboard(variant=rules.DEFAULT_VARIANT):
+    """Difficulty selection buttons"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🟢 Easy", callback_data=f"difficulty_easy_{variant}")],
+        [InlineKeyboardButton("🟡 Medium", callback_data=f"difficulty_medium_{variant}")],
+        [InlineKeyboardButton("🔴 Hard", callback_data=f"difficulty_hard_{variant}")],
+        [InlineKeyboardButton("💀 Impossible", callback_data=f"difficulty_impossible_{variant}")],
+        [InlineKeyboardButton("◀️ Back", callback_data="play_bot")]
+    ])
+
+def get_game_keyboard(game_session, sub_board=None):
+    """Generate game board keyboard (any variant, one button row per board row)"""
+    if game_session.rules is ultimate.RULES:
+        return get_ultimate_keyboard(game_session, sub_board)
+    
+    board = game_session.board
+    game_id = game_session.game_id
+    size = game_session.rules.size
     
     keyboard = []
-    for row in range(3):
+    for row in range(size):
         row_buttons = []
-        for col in range(3):
-            pos = row * 3 + col
+        for col in range(size):
+            pos = row * size + col
             if board[pos] == 0:
                 btn_text = "⬜"
                 callback = f"move_{game_id}_{pos}"
@@ -112,6 +185,58 @@ def get_game_keyboard(game_session):
     
     return InlineKeyboardMarkup(keyboard)
 
+def get_ultimate_keyboard(game_session, sub_board=None):
+    """Ultimate keyboard: cells of one 3x3 board, or a picker when any board is open
+
+    81 cells would break Telegram's 8-buttons-per-row limit, so only the
+    board in play is shown as buttons.
+    """
+    state = ultimate.get_state(game_session)
+    game_id = game_session.game_id
+    if state.forced >= 0:
+        sub_board = state.forced
+    elif sub_board is not None and state.closed >> sub_board & 1:
+        sub_board = None
+    
+    keyboard = []
+    if sub_board is None:
+        # Board picker
+        for row in range(3):
+            row_buttons = []
+            for col in range(3):
+                b = row * 3 + col
+                if state.macro_x >> b & 1:
+                    row_buttons.append(InlineKeyboardButton("❌", callback_data="occupied"))
+                elif state.macro_o >> b & 1:
+                    row_buttons.append(InlineKeyboardButton("⭕", callback_data="occupied"))
+                elif state.closed >> b & 1:
+                    row_buttons.append(InlineKeyboardButton("⬛", callback_data="occupied"))
+                else:
+                    row_buttons.append(InlineKeyboardButton(f"{b + 1}️⃣", callback_data=f"uboard_{game_id}_{b}"))
+            keyboard.append(row_buttons)
+    else:
+        x_sub = state.xs[sub_board]
+        o_sub = state.os[sub_board]
+        keyboard.append([InlineKeyboardButton(f"🎯 Board {sub_board + 1}", callback_data="occupied")])
+        for row in range(3):
+            row_buttons = []
+            for col in range(3):
+                pos = row * 3 + col
+                if x_sub >> pos & 1:
+                    row_buttons.append(InlineKeyboardButton("❌", callback_data="occupied"))
+                elif o_sub >> pos & 1:
+                    row_buttons.append(InlineKeyboardButton("⭕", callback_data="occupied"))
+                else:
+                    row_buttons.append(InlineKeyboardButton(
+                        "⬜", callback_data=f"move_{game_id}_{sub_board * 9 + pos}"))
+            keyboard.append(row_buttons)
+        if state.forced < 0:
+            keyboard.append([InlineKeyboardButton("◀️ Boards", callback_data=f"uboard_{game_id}_any")])
+    
+    keyboard.append([InlineKeyboardButton("🏳️ Surrender", callback_data=f"forfeit_{game_id}")])
+    
+    return InlineKeyboardMarkup(keyboard)
+
 def get_game_over_keyboard():
     """Game over buttons"""
     return InlineKeyboardMarkup([
@@ -122,7 +247,8 @@ def get_game_over_keyboard():
 def get_forcesub_keyboard():
     """Forcesub buttons"""
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📢 Join Channel", url=config.FORCESUB_CHANNEL)]
+        [InlineKeyboardButton("📢 Join Channel", url=config.FORCESUB_CHANNEL)],
+        [InlineKeyboardButton("✅ I've Joined", callback_data="joined")]
     ])
 
 def get_challenge_keyboard(challenge_id):
@@ -147,23 +273,91 @@ def generate_game_id():
 
 def render_board(game_session):
     """Render game board as text"""
-    board = game_session['board']
+    if game_session.rules is ultimate.RULES:
+        return render_ultimate_board(game_session)
+    
+    board = game_session.board
+    game_rules = game_session.rules
+    size = game_rules.size
     symbols = {0: '⬜', 1: '❌', 2: '⭕'}
     
+    rows = "\n".join(
+        "    " + "  ".join(symbols[cell] for cell in board[row * size:(row + 1) * size])
+        for row in range(size)
+    )
+    goal = "" if game_rules.name == rules.DEFAULT_VARIANT else f" • {game_rules.k} in a row"
+    
     text = f"""━━━━━━━━━━━━━━━━━━━━━━
  TIC TAC TOE • ARENA
 ━━━━━━━━━━━━━━━━━━━━━━
-You ❌  •  ⭕ Bot
+You ❌  •  ⭕ Bot{goal}
 
-    {symbols[board[0]]}  {symbols[board[1]]}  {symbols[board[2]]}
-    {symbols[board[3]]}  {symbols[board[4]]}  {symbols[board[5]]}
-    {symbols[board[6]]}  {symbols[board[7]]}  {symbols[board[8]]}
+{rows}
 
 Your turn
 ━━━━━━━━━━━━━━━━━━━━━━"""
     
     return text
 
+def render_ultimate_board(game_session):
+    """Render the nine boards plus the big-board summary"""
+    state = ultimate.get_state(game_session)
+    symbols = {0: '⬜', 1: '❌', 2: '⭕'}
+    
+    lines = []
+    for big_row in range(3):
+        for row in range(3):
+            chunks = []
+            for big_col in range(3):
+                b = big_row * 3 + big_col
+                cells = []
+                for col in range(3):
+                    pos = row * 3 + col
+                    value = 1 if state.xs[b] >> pos & 1 else 2 if state.os[b] >> pos & 1 else 0
+                    cells.append(symbols[value])
+                chunks.append("".join(cells))
+            lines.append("┃".join(chunks))
+        if big_row < 2:
+            lines.append("━━━╋━━━╋━━━")
+    
+    summary = []
+    for row in range(3):
+        marks = []
+        for col in range(3):
+            b = row * 3 + col
+            if state.macro_x >> b & 1:
+                marks.append('❌')
+            elif state.macro_o >> b & 1:
+                marks.append('⭕')
+            elif state.closed >> b & 1:
+                marks.append('⬛')
+            elif b == state.forced:
+                marks.append('🎯')
+            else:
+                marks.append('⬜')
+        summary.append("    " + "".join(marks))
+    
+    if state.forced >= 0:
+        next_board = f"Play in board {state.forced + 1} 🎯"
+    else:
+        next_board = "Play in any open board"
+    
+    board_text = "\n".join(lines)
+    summary_text = "\n".join(summary)
+    
+    return f"""━━━━━━━━━━━━━━━━━━━━━━
+ ULTIMATE • ARENA
+━━━━━━━━━━━━━━━━━━━━━━
+You ❌  •  ⭕ Bot
+
+{board_text}
+
+Boards:
+{summary_text}
+
+{next_board}
+━━━━━━━━━━━━━━━━━━━━━━"""
+
 def format_stats(stats):
     """Format user statistics"""
     if not stats:
@@ -189,6 +383,13 @@ Best Streak: {stats['best_streak']} 🔥
 
 ━━━━━━━━━━━━━━━━━━━━━━"""
 
+def format_result_stats(stats):
+    """Totals line under a game-over message"""
+    text = f"\n⭐ Total: {stats.get('points', 0)} Points"
+    if stats.get('streak', 0) > 1:
+        text += f" • 🔥 {stats['streak']} win streak"
+    return text
+
 def format_leaderboard(players):
     """Format leaderboard"""
     text = """━━━━━━━━━━━━━━━━━━━━━━
@@ -207,6 +408,29 @@ def format_leaderboard(players):
     
     return text
 
+def format_broadcast_progress(job):
+    """Broadcast status: counts, throughput and ETA"""
+    done = job['sent'] + job['failed'] + job['blocked']
+    rate = done / job['elapsed'] if job['elapsed'] else 0.0
+    percent = done / job['total'] * 100 if job['total'] else 100.0
+    if job['status'] == 'done':
+        header = "✅ BROADCAST COMPLETE"
+        eta = ""
+    else:
+        header = "📣 BROADCASTING"
+        remaining = max(job['total'] - done, 0)
+        eta = f"\nETA: {remaining / rate:.0f}s" if rate else ""
+    
+    return f"""━━━━━━━━━━━━━━━━━━━━━━
+ {header}
+━━━━━━━━━━━━━━━━━━━━━━
+
+Progress: {done}/{job['total']} ({percent:.1f}%)
+Sent: {job['sent']} • Failed: {job['failed']} • Blocked: {job['blocked']}
+Speed: {rate:.1f} msg/s{eta}
+
+━━━━━━━━━━━━━━━━━━━━━━"""
+
 def get_challenge_message(challenger_name):
     """Format challenge message"""
     return f"""━━━━━━━━━━━━━━━━━━━━━━
@@ -219,7 +443,7 @@ def get_challenge_message(challenger_name):
 
 Who dares to accept?
 
-⏰ Expires in 60 seconds
+⏰ Expires in {config.CHALLENGE_TIMEOUT} seconds
 ━━━━━━━━━━━━━━━━━━━━━━"""
 
 async def check_membership(bot, user_id):
@@ -251,10 +475,21 @@ Moves: {game_data.get('moves_count')}
 ━━━━━━━━━━━━━━━━━━━━━━"""
     
     try:
-        await bot.send_message(config.LOG_GROUP_ID, message)
+        await bot.send_message(config.LOG_GROUP_ID, message, rate_limit_args=outbox.BULK)
     except:
         pass
 
+def post_game_result(bot, game_data):
+    """Start log_game_result without waiting for it (never await BULK on a handler)"""
+    if not config.LOG_GROUP_ID:
+        return
+    if len(_log_tasks) >= MAX_PENDING_LOGS:
+        logger.warning(f"Log group backlog full, not logging {game_data.get('game_id')}")
+        return
+    task = asyncio.get_running_loop().create_task(log_game_result(bot, game_data))
+    _log_tasks.add(task)
+    task.add_done_callback(_log_tasks.discard)
+
 def get_welcome_message(name):
     """Get welcome message with name"""
     return WELCOME_MESSAGE.format(name=name)